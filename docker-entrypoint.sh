@@ -0,0 +1,10 @@
+#!/bin/sh
+set -e
+
+# Sample files left by the processes of a previous run would be summed into the new ones
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+exec "$@"
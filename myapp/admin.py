@@ -1,8 +1,130 @@
 from django.contrib import admin
-from .models import Webhook
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.http import QueryDict
+from rest_framework.exceptions import ValidationError
+
+from .filters import filter_data, parse_json_param
+from .breaker import reset
+from .models import (
+    CircuitBreaker, DeadLetter, DeliveryAttempt, RetentionPolicy, RetryPolicy, Subscription, Topic, Webhook,
+)
+from .ownership import forgetting_owners
+from .retries import redrive_dead_letters
+
+
+class WebhookDataFilter(admin.ListFilter):
+    # Takes ?contains=<json> and ?has_key=<key> like the API does, both served by the GIN index on data.
+    title = "data"
+    parameters = ["contains", "has_key"]
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        self.used_parameters = {name: params.pop(name) for name in self.parameters if name in params}
+
+    def has_output(self):
+        return True
+
+    def expected_parameters(self):
+        return self.parameters
+
+    def choices(self, changelist):
+        yield {
+            "selected": not self.used_parameters,
+            "query_string": changelist.get_query_string(remove=self.parameters),
+            "display": "All",
+        }
+        for name, value in self.used_parameters.items():
+            yield {
+                "selected": True,
+                "query_string": changelist.get_query_string(remove=[name]),
+                "display": f"{name}: {value}",
+            }
+
+    def queryset(self, request, queryset):
+        params = QueryDict(mutable=True)
+        params.update(self.used_parameters)
+        try:
+            return filter_data(queryset, params)
+        except ValidationError as exc:
+            raise IncorrectLookupParameters(exc.detail)
 
 
 @admin.register(Webhook)
 class WebhookAdmin(admin.ModelAdmin):
-    list_display = ["data", "user", "created_at"]
+    list_display = ["data", "user", "created_at", "priority"]
+    list_filter = [WebhookDataFilter]
     search_fields = ['user__username']
+
+    def get_search_results(self, request, queryset, search_term):
+        # A JSON object or array searches by containment instead of by username.
+        if search_term.startswith(('{', '[')):
+            try:
+                contains = parse_json_param({'contains': search_term}, 'contains')
+            except ValidationError:
+                pass
+            else:
+                return queryset.filter(data__contains=contains), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def delete_queryset(self, request, queryset):
+        with forgetting_owners():
+            super().delete_queryset(request, queryset)
+
+
+@admin.register(RetentionPolicy)
+class RetentionPolicyAdmin(admin.ModelAdmin):
+    list_display = ["user", "retention"]
+    search_fields = ['user__username']
+
+
+@admin.register(RetryPolicy)
+class RetryPolicyAdmin(admin.ModelAdmin):
+    list_display = ["name", "max_retries", "base_delay", "max_delay", "max_age"]
+
+
+@admin.register(DeadLetter)
+class DeadLetterAdmin(admin.ModelAdmin):
+    list_display = ["task_id", "webhook", "attempts", "error", "created_at", "redriven_at"]
+    list_filter = ["redriven_at"]
+    search_fields = ['task_id', 'webhook__user__username']
+    raw_id_fields = ["payload"]
+    actions = ["redrive"]
+
+    @admin.action(description="Redrive selected dead letters")
+    def redrive(self, request, queryset):
+        count = redrive_dead_letters(queryset)
+        self.message_user(request, f"Redrove {count} dead letters")
+
+
+@admin.register(DeliveryAttempt)
+class DeliveryAttemptAdmin(admin.ModelAdmin):
+    list_display = ["task_id", "webhook", "attempt", "status", "response_code", "latency_ms", "created_at"]
+    list_filter = ["status"]
+    search_fields = ['task_id']
+
+
+class SubscriptionInline(admin.TabularInline):
+    model = Subscription
+    raw_id_fields = ["webhook"]
+
+
+@admin.register(Topic)
+class TopicAdmin(admin.ModelAdmin):
+    list_display = ["name", "user", "created_at"]
+    search_fields = ['name', 'user__username']
+    inlines = [SubscriptionInline]
+
+
+@admin.register(CircuitBreaker)
+class CircuitBreakerAdmin(admin.ModelAdmin):
+    list_display = ["host", "state", "failures", "requests", "opened_at", "updated_at"]
+    list_filter = ["state"]
+    search_fields = ['host']
+    readonly_fields = ["host", "state", "failures", "requests", "opened_at", "updated_at"]
+    actions = ["close"]
+
+    @admin.action(description="Close selected circuit breakers")
+    def close(self, request, queryset):
+        hosts = list(queryset.values_list('host', flat=True))
+        reset(hosts)
+        self.message_user(request, f"Closed {len(hosts)} circuit breakers")
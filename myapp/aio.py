@@ -0,0 +1,377 @@
+import asyncio
+import base64
+import logging
+import queue
+import ssl
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from celery import current_app, states
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
+from kombu.serialization import dumps
+
+from myapp import breaker, codec
+from myapp.delivery import DeliveryError, check_status, prepare_delivery, record_attempt
+from myapp.metrics import DELIVERY_RETRIES, ENQUEUED_AT_HEADER, observe_lag
+from myapp.models import DeliveryAttempt, RetryPolicy
+from myapp.redis_client import get_async_redis, get_redis
+from myapp.retries import handle_delivery_failure, park_delivery, schedule_retry
+from myapp.routing import DeficitRoundRobin, delivery_quanta, delivery_queues
+
+logger = logging.getLogger(__name__)
+
+DRAIN_INTERVAL = 0.05
+
+
+class AsyncHTTPClient:
+
+    def __init__(self, max_per_host=None, connect_timeout=None, read_timeout=None):
+        self.max_per_host = max_per_host or settings.WEBHOOK_DELIVERY_POOL_MAXSIZE
+        self.connect_timeout = connect_timeout or settings.WEBHOOK_DELIVERY_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.WEBHOOK_DELIVERY_READ_TIMEOUT
+        self._idle = defaultdict(list)
+        self._limits = {}
+        self._ssl_context = None
+
+    async def post(self, url, body, headers=None):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        target = parts.path or '/'
+        if parts.query:
+            target = f'{target}?{parts.query}'
+
+        # Built from hostname and port, so userinfo in the URL never reaches the receiver.
+        host = f'[{parts.hostname}]' if ':' in parts.hostname else parts.hostname
+        if parts.port:
+            host = f'{host}:{parts.port}'
+        lines = [
+            f'POST {target} HTTP/1.1',
+            f'Host: {host}',
+            'Content-Type: application/json',
+            f'Content-Length: {len(body)}',
+        ]
+        lines.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+        limit = self._limits.setdefault(key, asyncio.Semaphore(self.max_per_host))
+        async with limit:
+            # An idle keep-alive connection may have been closed by the server, retry once on a fresh one.
+            # Once the receiver has started answering, or has not answered in time, the request is never sent again.
+            while True:
+                reader, writer, reused = await self._acquire(key)
+                keep_alive = False
+                status_line = b''
+                try:
+                    async with asyncio.timeout(self.read_timeout):
+                        writer.write(request)
+                        await writer.drain()
+                        status_line = await reader.readline()
+                        status, keep_alive = await self._read_response(reader, status_line)
+                except TimeoutError as exc:
+                    # Checked first, the builtin TimeoutError is an OSError too.
+                    raise DeliveryError(f'Delivery to {url} timed out') from exc
+                except (OSError, asyncio.IncompleteReadError) as exc:
+                    if reused and not status_line:
+                        continue
+                    raise DeliveryError(f'Delivery to {url} failed: {exc!r}') from exc
+                except (ValueError, asyncio.LimitOverrunError) as exc:
+                    raise DeliveryError(f'Malformed response from {url}: {exc}') from exc
+                finally:
+                    # Only a connection that returned a complete keep-alive response goes back to the pool.
+                    if not keep_alive:
+                        writer.close()
+                break
+
+        if keep_alive:
+            self._idle[key].append((reader, writer))
+
+        return check_status(status)
+
+    async def aclose(self):
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+    async def _acquire(self, key):
+        connections = self._idle[key]
+        while connections:
+            reader, writer = connections.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+
+        scheme, host, port = key
+        ssl_context = None
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            ssl_context = self._ssl_context
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=ssl_context), self.connect_timeout
+            )
+        except OSError as exc:
+            raise DeliveryError(f'Could not connect to {host}:{port}: {exc}') from exc
+        return reader, writer, False
+
+    async def _read_response(self, reader, status_line):
+        if not status_line:
+            raise ConnectionResetError('Connection closed before a response was received')
+        version, status = status_line.decode('latin-1').split(None, 2)[:2]
+        status = int(status)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection') != 'close'
+        if 'chunked' in headers.get('transfer-encoding', ''):
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                await reader.readexactly(size + 2)
+        elif 'content-length' in headers:
+            await reader.readexactly(int(headers['content-length']))
+        elif status >= 200 and status not in (204, 304):
+            await reader.read()
+            keep_alive = False
+        return status, keep_alive
+
+
+def _envelope(task, args, kwargs, queue, task_id, countdown=None):
+    # The same envelope kombu's Redis transport would push.
+    app = task.app
+    message = app.amqp.as_task_v2(task_id, task.name, args, kwargs, countdown=countdown)
+    content_type, content_encoding, body = dumps(message.body, serializer=app.conf.task_serializer)
+    if isinstance(body, str):
+        body = body.encode(content_encoding)
+
+    envelope = {
+        'body': base64.b64encode(body).decode('ascii'),
+        'content-encoding': content_encoding,
+        'content-type': content_type,
+        'headers': {**message.headers, ENQUEUED_AT_HEADER: time.time()},
+        'properties': {
+            **message.properties,
+            'delivery_mode': 2,
+            'delivery_info': {'exchange': queue.exchange.name, 'routing_key': queue.routing_key},
+            'priority': 0,
+            'body_encoding': 'base64',
+            'delivery_tag': str(uuid.uuid4()),
+        },
+    }
+    return codec.dumps(envelope)
+
+
+def _queue(task, queue):
+    app = task.app
+    return app.amqp.queues[queue] if queue else app.amqp.router.route({}, task.name)['queue']
+
+
+async def enqueue_task(task, args=None, kwargs=None, queue=None, task_id=None, countdown=None):
+    # Pushes straight to Redis, without blocking the loop on the broker.
+    queue = _queue(task, queue)
+    task_id = task_id or str(uuid.uuid4())
+    await get_async_redis().lpush(queue.name, _envelope(task, args, kwargs, queue, task_id, countdown))
+    return task_id
+
+
+async def enqueue_tasks(task, calls):
+    # Takes (kwargs, queue, task_id) per call and pushes them all in one round trip, one LPUSH per queue.
+    messages = defaultdict(list)
+    for kwargs, queue_name, task_id in calls:
+        route = _queue(task, queue_name)
+        messages[route.name].append(_envelope(task, None, kwargs, route, task_id))
+    async with get_async_redis().pipeline(transaction=False) as pipe:
+        for name, envelopes in messages.items():
+            pipe.lpush(name, *envelopes)
+        await pipe.execute()
+
+
+class AsyncDeliveryWorker:
+
+    def __init__(self, queue_names=None, max_in_flight=None):
+        self.queue_names = queue_names or delivery_queues()
+        self.max_in_flight = max_in_flight or settings.WEBHOOK_ASYNC_MAX_IN_FLIGHT
+        self.scheduler = DeficitRoundRobin(delivery_quanta(self.queue_names))
+        self.app = current_app._get_current_object()
+        self.task = self.app.tasks['myapp.tasks.send_data_task']
+        self.loop = asyncio.new_event_loop()
+        self.client = AsyncHTTPClient()
+        self._finished = queue.Queue()
+        self._in_flight = 0
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self):
+        loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        loop_thread.start()
+        try:
+            with self.app.connection_for_read() as connection:
+                # Kombu connections are not thread safe, so this thread both fetches and acknowledges.
+                # Messages are pulled only while there is room, so what cannot start yet stays in the broker
+                # where the scheduler can still choose between tenants.
+                channel = connection.default_channel
+                queues = {name: self.app.amqp.queues[name].bind(channel) for name in self.queue_names}
+                while not self._stopping.is_set():
+                    if not self._fetch(queues):
+                        self._acknowledge_finished(block=True)
+                    self._acknowledge_finished()
+                while self._in_flight:
+                    self._acknowledge_finished(block=True)
+        finally:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            loop_thread.join()
+
+    async def _shutdown(self):
+        await self.client.aclose()
+        await sync_to_async(connections.close_all)()
+
+    def _backlog(self):
+        with get_redis().pipeline(transaction=False) as pipe:
+            for name in self.queue_names:
+                pipe.llen(name)
+            return dict(zip(self.queue_names, pipe.execute()))
+
+    def _fetch(self, queues):
+        fetched = 0
+        slots = self.max_in_flight - self._in_flight
+        waiting = self._backlog() if slots > 0 else {}
+        while fetched < slots:
+            name = self.scheduler.pick(waiting)
+            if name is None:
+                break
+            message = queues[name].get(accept=self.app.conf.accept_content)
+            if message is None:
+                # Taken by another worker since the backlog was read.
+                waiting[name] = 0
+                continue
+            self.on_message(message.decode(), message)
+            fetched += 1
+        return fetched
+
+    def on_message(self, body, message):
+        if message.headers.get('task') != self.task.name:
+            logger.error('Rejecting unexpected task %s', message.headers.get('task'))
+            message.reject()
+            return
+
+        args, kwargs, _ = body
+        observe_lag(self.task.name, message.headers.get(ENQUEUED_AT_HEADER))
+        self._in_flight += 1
+        future = asyncio.run_coroutine_threadsafe(
+            self.execute(message.headers['id'], args, kwargs, message.headers.get('retries') or 0,
+                         message.headers.get('eta')),
+            self.loop,
+        )
+        future.add_done_callback(lambda _: self._finished.put(message))
+
+    def _acknowledge_finished(self, block=False):
+        try:
+            message = self._finished.get(timeout=DRAIN_INTERVAL if block else None, block=block)
+        except queue.Empty:
+            return
+        while message is not None:
+            message.ack()
+            self._in_flight -= 1
+            try:
+                message = self._finished.get_nowait()
+            except queue.Empty:
+                message = None
+
+    def _prepare(self, data, webhook_id, payload, events):
+        # Same connection housekeeping Celery does around each task.
+        close_old_connections()
+        return prepare_delivery(data, webhook_id, payload, events)
+
+    async def execute(self, task_id, args, kwargs, retries=0, eta=None):
+        if eta:
+            eta = datetime.fromisoformat(eta)
+            if timezone.is_naive(eta):
+                eta = timezone.make_aware(eta, dt_timezone.utc)
+            await asyncio.sleep(max((eta - timezone.now()).total_seconds(), 0))
+
+        data = args[0] if args else kwargs.get('data')
+        webhook_id = args[1] if len(args) > 1 else kwargs.get('webhook_id')
+        first_attempt_at = kwargs.get('first_attempt_at') or time.time()
+        delivery = None
+        try:
+            delivery = await sync_to_async(self._prepare)(data, webhook_id, kwargs.get('payload'), kwargs.get('events'))
+            result = await self._deliver(delivery, task_id, retries, first_attempt_at)
+        except Exception as exc:
+            # Anything unexpected is retried like a failed delivery, instead of being acknowledged and lost.
+            logger.exception('Delivery task %s failed', task_id)
+            try:
+                result = await sync_to_async(self._fail)(
+                    delivery, task_id, args, kwargs, retries, first_attempt_at, exc
+                )
+            except Exception:
+                logger.exception('Could not retry delivery task %s', task_id)
+                return
+        if result is None:
+            return
+        try:
+            await sync_to_async(self.task.backend.store_result)(task_id, result, states.SUCCESS)
+        except Exception:
+            logger.exception('Could not store the result of delivery task %s', task_id)
+
+    async def _deliver(self, delivery, task_id, retries, first_attempt_at):
+        # Returns the task result, or None once the delivery is waiting in the retry scheduler.
+        if delivery.skip_reason:
+            await sync_to_async(record_attempt)(
+                delivery, task_id, retries + 1, DeliveryAttempt.SKIPPED, error=delivery.skip_reason
+            )
+            return {'error': delivery.skip_reason, 'md5': delivery.md5}
+        if wait := await sync_to_async(breaker.allow)(delivery.host):
+            return await sync_to_async(park_delivery)(delivery, task_id, retries, first_attempt_at, wait)
+
+        started = time.perf_counter()
+        try:
+            status = await self.client.post(delivery.target_url, delivery.body, headers=delivery.headers)
+        except DeliveryError as exc:
+            result = await sync_to_async(handle_delivery_failure)(
+                delivery, task_id, retries, first_attempt_at, exc, latency=time.perf_counter() - started
+            )
+            if result is None:
+                await sync_to_async(self.task.backend.mark_as_retry)(task_id, exc)
+            return result
+        await sync_to_async(record_attempt)(
+            delivery, task_id, retries + 1, DeliveryAttempt.DELIVERED,
+            latency=time.perf_counter() - started, response_code=status,
+        )
+        return delivery.result(status)
+
+    def _fail(self, delivery, task_id, args, kwargs, retries, first_attempt_at, exc):
+        error = DeliveryError(f'Delivery task failed: {exc!r}')
+        if delivery is not None:
+            result = handle_delivery_failure(delivery, task_id, retries, first_attempt_at, error)
+        else:
+            # Not even prepared, so it goes back with the arguments it came with until the default policy gives up.
+            policy = RetryPolicy.default()
+            if retries >= policy.max_retries:
+                return {'error': 'Max retries exceeded'}
+            schedule_retry(task_id, args, {**kwargs, 'first_attempt_at': first_attempt_at}, retries + 1,
+                           policy.backoff(retries))
+            DELIVERY_RETRIES.inc()
+            result = None
+        if result is None:
+            self.task.backend.mark_as_retry(task_id, error)
+        return result
@@ -0,0 +1,167 @@
+import gzip
+import mmap
+import os
+import struct
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from glob import glob
+from itertools import groupby, islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+
+from myapp import codec
+from myapp.models import Webhook
+
+# One record per gzip block of a segment: user id range, created_at range in microseconds, offset, length, rows.
+INDEX_RECORD = struct.Struct('<qqqqQII')
+DAY_FORMAT = '%Y-%m-%d'
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Sorted by user within each day, so the blocks of a segment cover narrow user ranges.
+ARCHIVE_SQL = (
+    "SELECT id, user_id, created_at, target_url, data::text FROM {table} {where} "
+    "ORDER BY (created_at AT TIME ZONE 'UTC')::date, user_id, created_at, id"
+)
+
+
+def archive_enabled():
+    return bool(settings.WEBHOOK_ARCHIVE_DIR)
+
+
+def _microseconds(moment):
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def _line(row):
+    # The export's NDJSON shape plus user_id, data is written as Postgres rendered it.
+    webhook_id, user_id, created_at, target_url, data = row
+    return (
+        f'{{"id": {webhook_id}, "user_id": {user_id}, "created_at": "{created_at.isoformat()}", '
+        f'"target_url": {codec.dumps_str(target_url)}, "data": {data}}}\n'
+    ).encode('utf-8')
+
+
+def _blocks(rows, size):
+    rows = iter(rows)
+    while block := list(islice(rows, size)):
+        yield block
+
+
+def _replace(path, write):
+    with open(f'{path}.tmp', 'wb') as output:
+        write(output)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(f'{path}.tmp', path)
+
+
+def _write_segment(day, rows):
+    # Blocks are separate gzip members, so a reader can decompress one on its own and zcat still reads the file.
+    directory = os.path.join(settings.WEBHOOK_ARCHIVE_DIR, day.strftime(DAY_FORMAT))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{time.time_ns()}-{uuid.uuid4().hex[:8]}')
+    index = bytearray()
+    archived = 0
+
+    def write_blocks(output):
+        nonlocal archived
+        offset = 0
+        for block in _blocks(rows, settings.WEBHOOK_ARCHIVE_BLOCK_ROWS):
+            data = gzip.compress(b''.join(_line(row) for row in block))
+            moments = [_microseconds(row[2]) for row in block]
+            index.extend(INDEX_RECORD.pack(
+                block[0][1], block[-1][1], min(moments), max(moments), offset, len(data), len(block)
+            ))
+            output.write(data)
+            offset += len(data)
+            archived += len(block)
+
+    _replace(f'{path}.ndjson.gz', write_blocks)
+    # The index is renamed into place last, readers only see segments that have one.
+    _replace(f'{path}.idx', lambda output: output.write(index))
+    return archived
+
+
+def _archive(cursor):
+    archived = 0
+    for day, rows in groupby(cursor, key=lambda row: row[2].astimezone(dt_timezone.utc).date()):
+        archived += _write_segment(day, rows)
+    return archived
+
+
+def archive_webhooks(ids):
+    table = connection.ops.quote_name(Webhook._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(ARCHIVE_SQL.format(table=table, where='WHERE id = ANY(%s)'), [list(ids)])
+        return _archive(cursor)
+
+
+def archive_table(name):
+    # A detached partition is read through a server-side cursor, it may hold an hour of traffic.
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(ARCHIVE_SQL.format(table=connection.ops.quote_name(name), where=''))
+        return _archive(cursor)
+
+
+def _days(since, until):
+    directory = settings.WEBHOOK_ARCHIVE_DIR
+    days = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+    first = since.astimezone(dt_timezone.utc).strftime(DAY_FORMAT) if since else None
+    last = (until - timedelta(microseconds=1)).astimezone(dt_timezone.utc).strftime(DAY_FORMAT) if until else None
+    return [day for day in days if (first is None or day >= first) and (last is None or day <= last)]
+
+
+def _matching_blocks(index_path, user_ids, since, until):
+    # The index is memory-mapped, only the pages of the records that get scanned are read.
+    with open(index_path, 'rb') as index_file, \
+            mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ) as index:
+        return [
+            (offset, length)
+            for user_min, user_max, time_min, time_max, offset, length, _ in INDEX_RECORD.iter_unpack(index)
+            if (user_ids is None or any(user_min <= user_id <= user_max for user_id in user_ids))
+            and (since is None or time_max >= since) and (until is None or time_min < until)
+        ]
+
+
+def read_archive(user_ids=None, since=None, until=None):
+    # Yields NDJSON chunks, one per matching block, in archiving order rather than creation order.
+    user_ids = None if user_ids is None else set(user_ids)
+    since_us = None if since is None else _microseconds(since)
+    until_us = None if until is None else _microseconds(until)
+    for day in _days(since, until):
+        for index_path in sorted(glob(os.path.join(settings.WEBHOOK_ARCHIVE_DIR, day, '*.idx'))):
+            blocks = _matching_blocks(index_path, user_ids, since_us, until_us)
+            if not blocks:
+                continue
+            with open(f'{index_path[:-len(".idx")]}.ndjson.gz', 'rb') as segment:
+                for offset, length in blocks:
+                    segment.seek(offset)
+                    lines = [
+                        line for line in gzip.decompress(segment.read(length)).splitlines(keepends=True)
+                        if _matches(codec.loads(line), user_ids, since, until)
+                    ]
+                    if lines:
+                        yield b''.join(lines)
+
+
+def _matches(row, user_ids, since, until):
+    if user_ids is not None and row['user_id'] not in user_ids:
+        return False
+    if since is None and until is None:
+        return True
+    created_at = datetime.fromisoformat(row['created_at'])
+    return (since is None or created_at >= since) and (until is None or created_at < until)
+
+
+async def aread_archive(user_ids=None, since=None, until=None):
+    # Reads and decompresses in a thread, a block at a time, like aiter_export drives its cursor.
+    chunks = read_archive(user_ids, since, until)
+    next_chunk = sync_to_async(next, thread_sensitive=False)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=False)()
@@ -0,0 +1,43 @@
+from rest_framework import authentication, exceptions
+
+from .identity import KeysUnavailable, TokenError, sync_user, verify_token
+
+
+class InvalidToken(exceptions.APIException):
+    # Not an AuthenticationFailed, which DRF turns into a 403 because session authentication comes first.
+    status_code = 401
+    default_code = 'authentication_failed'
+    auth_header = 'Bearer realm="api"'
+
+
+class KeycloakUnavailable(exceptions.APIException):
+    status_code = 503
+    default_detail = 'Tokens cannot be verified right now, try again later.'
+    default_code = 'service_unavailable'
+
+
+class KeycloakJWTAuthentication(authentication.BaseAuthentication):
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid bearer header.')
+
+        try:
+            token = auth[1].decode()
+            claims = verify_token(token)
+        except (UnicodeError, TokenError) as exc:
+            raise InvalidToken(f'Invalid token: {exc}')
+        except KeysUnavailable:
+            raise KeycloakUnavailable()
+
+        user = sync_user(claims)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return user, claims
+
+    def authenticate_header(self, request):
+        return f'{self.keyword} realm="api"'
@@ -0,0 +1,87 @@
+import math
+import uuid
+
+from celery import current_app
+from django.conf import settings
+
+from myapp.delivery import Delivery, record_attempt
+from myapp.models import DeliveryAttempt, Payload, Webhook
+from myapp.payloads import build_batch_payload, store_payload
+from myapp.redis_client import get_async_redis, get_redis
+from myapp.routing import delivery_queue
+
+BATCH_KEY = 'webhook:batch:{}'
+BATCH_BYTES_KEY = 'webhook:batch:{}:bytes'
+BATCH_TIMER_KEY = 'webhook:batch:{}:timer'
+
+# A lost flush only holds a batch until its timer key expires, the next write then schedules another.
+TIMER_GRACE = 30
+
+APPEND_SCRIPT = """
+local length = redis.call('RPUSH', KEYS[1], ARGV[1])
+local size = redis.call('INCRBY', KEYS[2], ARGV[2])
+local timer = redis.call('SET', KEYS[3], '1', 'NX', 'EX', ARGV[3])
+return {length, size, timer and 1 or 0}
+"""
+
+TAKE_SCRIPT = """
+local entries = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3])
+return entries
+"""
+
+
+def _keys(webhook_id):
+    return [BATCH_KEY.format(webhook_id), BATCH_BYTES_KEY.format(webhook_id), BATCH_TIMER_KEY.format(webhook_id)]
+
+
+async def aappend(webhook_id, task_id, payload, window):
+    # Returns the seconds until the batch must be flushed, None when a flush is already on its way.
+    length, size, timer = await get_async_redis().eval(
+        APPEND_SCRIPT, 3, *_keys(webhook_id), f'{task_id}:{payload.digest}', payload.size,
+        math.ceil(window) + TIMER_GRACE,
+    )
+    if length >= settings.WEBHOOK_BATCH_MAX_EVENTS or size >= settings.WEBHOOK_BATCH_MAX_BYTES:
+        return 0
+    return window if timer else None
+
+
+def pending_events(webhook_id):
+    return get_redis().llen(BATCH_KEY.format(webhook_id))
+
+
+def batched_payloads():
+    # Digests of the events waiting in open batches.
+    client = get_redis()
+    digests = set()
+    for key in client.scan_iter(match=BATCH_KEY.format('*'), count=1000, _type='LIST'):
+        digests.update(entry.decode().split(':')[1] for entry in client.lrange(key, 0, -1))
+    return digests
+
+
+def flush_batch(webhook_id):
+    entries = get_redis().eval(TAKE_SCRIPT, 3, *_keys(webhook_id))
+    if not entries:
+        return None
+
+    events = [entry.decode().split(':') for entry in entries]
+    bodies = dict(Payload.objects.filter(digest__in={digest for _, digest in events}).values_list('digest', 'body'))
+    route = Webhook.objects.filter(id=webhook_id).values_list('user_id', 'priority').first()
+    missing = [event for event, digest in events if digest not in bodies]
+    if missing:
+        # Events whose payload is gone answer as skipped, like a single delivery would, instead of riding along.
+        skipped = Delivery(webhook_id, None, events=missing)
+        skipped.exists = route is not None
+        record_attempt(skipped, None, 1, DeliveryAttempt.SKIPPED, error=skipped.skip_reason)
+        events = [(event, digest) for event, digest in events if digest in bodies]
+        if not events:
+            return None
+
+    payload = build_batch_payload([bytes(bodies[digest]) for _, digest in events])
+    store_payload(payload)
+    task_id = str(uuid.uuid4())
+    current_app.tasks['myapp.tasks.send_data_task'].apply_async(
+        kwargs={'webhook_id': webhook_id, 'payload': payload.digest, 'events': [event for event, _ in events]},
+        task_id=task_id, queue=delivery_queue(*route) if route else None,
+    )
+    return task_id
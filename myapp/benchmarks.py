@@ -0,0 +1,792 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from glob import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from urllib.parse import urlencode
+
+import urllib3
+from asgiref.sync import async_to_sync, sync_to_async
+from celery.result import _set_task_join_will_block
+from celery.worker import WorkController, state
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.test import AsyncRequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.test import APIClient, force_authenticate
+from rest_framework.views import APIView
+
+from myapp import breaker, codec, retention
+from myapp.aio import AsyncDeliveryWorker, AsyncHTTPClient
+from myapp.archive import archive_webhooks, read_archive
+from myapp.delivery import deliver
+from myapp.filters import filter_data
+from myapp.ingest import bulk_create_webhooks
+from myapp.models import DeliveryAttempt, Subscription, Topic, Webhook
+from myapp.redis_client import get_redis
+from myapp.routing import delivery_queue
+from myapp.serializers import WebhookSerializer
+from myapp.tasks import send_data_task
+from myapp.views import WebhookWriteView
+
+BENCHMARK_QUEUE = 'benchmark'
+COLD_TENANTS = 10
+COLD_TENANT_DELIVERIES = 10
+
+# Most queries a single request may run, `benchmark --check` fails when an endpoint goes over.
+# The write budget covers the first request for a webhook, later ones find its owner in the cache.
+QUERY_BUDGETS = {
+    'create': 1,
+    'list': 1,
+    'write': 2,
+    'task_result': 1,
+    'publish': 3,
+}
+FANOUT_SUBSCRIBERS = 100
+ARCHIVE_USERS = 20
+ENDPOINT_REQUESTS = 200
+
+
+def _payloads(rows):
+    return [{'data': {'index': index, 'key': 'value', 'flag': index % 2 == 0}} for index in range(rows)]
+
+
+def _user():
+    return User.objects.create(username=f'benchmark-{uuid.uuid4().hex}')
+
+
+def _users(count):
+    return [_user() for _ in range(count)]
+
+
+def _build_webhooks(rows, user, **fields):
+    return [Webhook(user=user, **{'data': payload['data'], **fields}) for payload in _payloads(rows)]
+
+
+def _webhook(user=None, **fields):
+    return Webhook.objects.create(user=user or _user(), **{'data': {'key': 'value'}, **fields})
+
+
+class StubReceiver:
+    # A local HTTP receiver answering every POST with `status` after `delay` seconds, and keeping what it got.
+
+    def __init__(self, status=200, delay=0):
+        self.status = status
+        self.delay = delay
+        self.requests = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = _ReceiverServer(('127.0.0.1', 0), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/hook'
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handler_class(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with receiver._lock:
+                    receiver.connections += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if receiver.delay:
+                    time.sleep(receiver.delay)
+                with receiver._lock:
+                    receiver.requests.append({
+                        'path': self.path, 'headers': dict(self.headers), 'body': body, 'received_at': time.time(),
+                    })
+                self.send_response(receiver.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class _ReceiverServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class _BenchmarkWorker(WorkController):
+
+    def __init__(self, *args, **kwargs):
+        self.ready = threading.Event()
+        super().__init__(*args, **kwargs)
+
+    def on_consumer_ready(self, consumer):
+        self.ready.set()
+
+
+@contextmanager
+def celery_worker(app, queues):
+    # A solo worker in a thread of this process, consuming only `queues`.
+    worker = _BenchmarkWorker(
+        app=app, concurrency=1, pool='solo', loglevel='WARNING', queues=queues, ready_callback=None,
+        without_heartbeat=True, without_mingle=True, without_gossip=True,
+    )
+    thread = threading.Thread(target=worker.start, daemon=True)
+    thread.start()
+    worker.ready.wait()
+    # Starting a worker marks joins as blocking, this process still waits on results it publishes.
+    _set_task_join_will_block(False)
+    try:
+        yield worker
+    finally:
+        state.should_terminate = 0
+        thread.join(10)
+        state.should_terminate = None
+
+
+def _rate(rows, started):
+    elapsed = time.perf_counter() - started
+    return {'rows': rows, 'seconds': round(elapsed, 4), 'rows_per_sec': round(rows / elapsed, 1)}
+
+
+def bench_ingest(rows):
+    results = {}
+    with transaction.atomic():
+        user = _user()
+        payloads = _payloads(rows)
+
+        started = time.perf_counter()
+        for payload in payloads:
+            serializer = WebhookSerializer(data=payload)
+            serializer.is_valid(raise_exception=True)
+            serializer.save(user=user)
+        results['single'] = _rate(rows, started)
+
+        started = time.perf_counter()
+        serializer = WebhookSerializer(data=payloads, many=True)
+        serializer.is_valid(raise_exception=True)
+        bulk_create_webhooks(user, serializer.validated_data)
+        results['bulk'] = _rate(rows, started)
+
+        transaction.set_rollback(True)
+    return results
+
+
+def bench_delivery(rows):
+    results = {}
+    body = json.dumps({'key': 'value'}).encode('utf-8')
+    with StubReceiver() as receiver:
+        started = time.perf_counter()
+        for _ in range(rows):
+            urllib3.PoolManager(retries=False).request('POST', receiver.url, body=body)
+        results['connection_per_delivery'] = _rate(rows, started)
+
+        connections = receiver.connections
+        started = time.perf_counter()
+        for _ in range(rows):
+            deliver(receiver.url, body)
+        results['pooled'] = _rate(rows, started)
+        results['pooled']['connections'] = receiver.connections - connections
+    return results
+
+
+def _per_cpu(result, cpu_started):
+    result['cpu_seconds'] = round(time.process_time() - cpu_started, 4)
+    result['rows_per_cpu_sec'] = round(result['rows'] / result['cpu_seconds'], 1) if result['cpu_seconds'] else None
+    return result
+
+
+def bench_async_delivery(rows, latency=0.02, max_in_flight=200):
+    results = {}
+    body = json.dumps({'key': 'value'}).encode('utf-8')
+
+    async def run_async(url):
+        client = AsyncHTTPClient(max_per_host=max_in_flight)
+        limit = asyncio.Semaphore(max_in_flight)
+
+        async def one():
+            async with limit:
+                await client.post(url, body)
+
+        await asyncio.gather(*(one() for _ in range(rows)))
+        await client.aclose()
+
+    with StubReceiver(delay=latency) as receiver:
+        # One prefork process handles one delivery at a time.
+        started, cpu_started = time.perf_counter(), time.process_time()
+        for _ in range(rows):
+            deliver(receiver.url, body)
+        results['prefork_process'] = _per_cpu(_rate(rows, started), cpu_started)
+
+        started, cpu_started = time.perf_counter(), time.process_time()
+        asyncio.run(run_async(receiver.url))
+        results['asyncio_process'] = _per_cpu(_rate(rows, started), cpu_started)
+    return results
+
+
+class _SyncWebhookWriteView(APIView):
+    # The write endpoint as it was before it went async, as a baseline.
+
+    def post(self, request, webhook_id):
+        try:
+            Webhook.objects.get(id=webhook_id, user=request.user)
+        except Webhook.DoesNotExist:
+            return Response({'error': 'Webhook not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        task = send_data_task.apply_async((request.data, webhook_id), queue=BENCHMARK_QUEUE)
+        return Response({'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
+
+
+class _AsyncWebhookWriteView(WebhookWriteView):
+    queue = BENCHMARK_QUEUE
+
+
+def _percentiles(latencies, started):
+    latencies = sorted(latencies)
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'seconds': round(elapsed, 4),
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+def _benchmark_routing():
+    # Deliveries the views route themselves go to BENCHMARK_QUEUE instead of the real shards.
+    return {'WEBHOOK_DELIVERY_QUEUE': BENCHMARK_QUEUE, 'WEBHOOK_DELIVERY_SHARDS': 0}
+
+
+def _unthrottled(writes):
+    # The buckets stay in the path, they are only made deep enough for every write to pass.
+    # A publish takes one token per subscriber.
+    return {'WEBHOOK_USER_WRITE_BURST': writes, 'WEBHOOK_WRITE_BURST': writes}
+
+
+def bench_api_latency(rows, concurrency=200):
+    # Drives the views the way the ASGI handler does: sync views run on the shared sync thread, async views on the loop.
+    results = {}
+    factory = AsyncRequestFactory()
+
+    async def load(view, webhook, user):
+        limit = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(index):
+            async with limit:
+                request = factory.post(
+                    f'/webhook/{webhook.id}/write/', {'index': index}, content_type='application/json'
+                )
+                force_authenticate(request, user=user)
+                started = time.perf_counter()
+                if asyncio.iscoroutinefunction(view):
+                    response = await view(request, webhook_id=webhook.id)
+                else:
+                    response = await sync_to_async(view)(request, webhook_id=webhook.id)
+                await sync_to_async(response.render)()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(rows)))
+        return _percentiles(latencies, started)
+
+    with transaction.atomic(), override_settings(**_unthrottled(rows)):
+        webhook = _webhook()
+        for name, view in (('sync_view', _SyncWebhookWriteView), ('async_view', _AsyncWebhookWriteView)):
+            results[name] = async_to_sync(load)(view.as_view(), webhook, webhook.user)
+        transaction.set_rollback(True)
+    get_redis().delete(BENCHMARK_QUEUE)
+    return results
+
+
+def _codec_rate(operations, size, started):
+    elapsed = time.perf_counter() - started
+    return {
+        'ops_per_sec': round(operations / elapsed, 1),
+        'mb_per_sec': round(operations * size / elapsed / 2 ** 20, 1),
+    }
+
+
+def bench_codec(rows):
+    results = {}
+    payloads = {
+        'small': _payloads(1)[0],
+        'large': {'items': _payloads(1000)},
+    }
+    codecs = {
+        'stdlib_json': (lambda value: json.dumps(value).encode('utf-8'), json.loads),
+        codec.BACKEND: (codec.dumps, codec.loads),
+    }
+    for size_name, payload in payloads.items():
+        operations = rows if size_name == 'small' else max(rows // 100, 10)
+        for codec_name, (dumps, loads) in codecs.items():
+            encoded = dumps(payload)
+
+            started = time.perf_counter()
+            for _ in range(operations):
+                dumps(payload)
+            encode = _codec_rate(operations, len(encoded), started)
+
+            started = time.perf_counter()
+            for _ in range(operations):
+                loads(encoded)
+            decode = _codec_rate(operations, len(encoded), started)
+
+            results[f'{size_name}_{codec_name}'] = {'bytes': len(encoded), 'encode': encode, 'decode': decode}
+    return results
+
+
+def _seed_webhooks(rows, user, **fields):
+    webhooks = _build_webhooks(rows, user, **fields)
+    return Webhook.objects.bulk_create(webhooks, batch_size=5000)
+
+
+def _measure_endpoint(name, client, requests):
+    latencies, queries = [], []
+    started = time.perf_counter()
+    for method, path, data in requests:
+        with CaptureQueriesContext(connection) as context:
+            request_started = time.perf_counter()
+            response = getattr(client, method)(path, data, format='json')
+            latencies.append(time.perf_counter() - request_started)
+        if response.status_code >= 400:
+            raise AssertionError(f'{name} returned {response.status_code}: {response.content[:200]}')
+        queries.append(len(context))
+
+    result = _percentiles(latencies, started)
+    result.update(
+        max_queries=max(queries),
+        query_budget=QUERY_BUDGETS[name],
+        within_budget=max(queries) <= QUERY_BUDGETS[name],
+    )
+    return result
+
+
+def bench_endpoints(rows):
+    # Every endpoint is measured against a table already holding `rows` webhooks of the caller.
+    results = {}
+    samples = min(rows, ENDPOINT_REQUESTS)
+    with transaction.atomic(), patch.object(WebhookWriteView, 'queue', BENCHMARK_QUEUE), \
+            override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], **_benchmark_routing(),
+                              **_unthrottled(samples * (FANOUT_SUBSCRIBERS + 1))):
+        user = _user()
+        webhooks = _seed_webhooks(rows, user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        results['create'] = _measure_endpoint('create', client, [
+            ('post', reverse('create-webhook'), payload) for payload in _payloads(samples)
+        ])
+
+        pages, path = [], reverse('webhook-list')
+        while len(pages) < samples and path:
+            pages.append(('get', path, {'page_size': 100}))
+            path = client.get(path, {'page_size': 100}).data['next']
+        results['list'] = _measure_endpoint('list', client, pages)
+
+        results['write'] = _measure_endpoint('write', client, [
+            ('post', reverse('write-webhook', args=[webhooks[index % len(webhooks)].id]), {'index': index})
+            for index in range(samples)
+        ])
+
+        task_ids = [str(uuid.uuid4()) for _ in range(samples)]
+        DeliveryAttempt.objects.bulk_create([
+            DeliveryAttempt(webhook=webhooks[index % len(webhooks)], task_id=task_id, attempt=1,
+                            status=DeliveryAttempt.DELIVERED, response_code=200, payload_digest='')
+            for index, task_id in enumerate(task_ids)
+        ])
+        results['task_result'] = _measure_endpoint('task_result', client, [
+            ('get', reverse('task-result', args=[task_id]), None) for task_id in task_ids
+        ])
+
+        topic = _seed_topic(user, webhooks[:FANOUT_SUBSCRIBERS])
+        results['publish'] = _measure_endpoint('publish', client, [
+            ('post', reverse('publish-topic', args=[topic.id]), {'index': index}) for index in range(samples)
+        ])
+        transaction.set_rollback(True)
+    get_redis().delete(BENCHMARK_QUEUE)
+    return results
+
+
+def _seed_topic(user, webhooks):
+    topic = Topic.objects.create(user=user, name=str(uuid.uuid4()))
+    Subscription.objects.bulk_create([Subscription(topic=topic, webhook=webhook) for webhook in webhooks])
+    return topic
+
+
+def bench_fanout(rows):
+    # One event to `rows` subscribers: a write call per subscriber against one publish call.
+    results = {}
+    with transaction.atomic(), patch.object(WebhookWriteView, 'queue', BENCHMARK_QUEUE), \
+            override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], **_benchmark_routing(),
+                              **_unthrottled(rows * 2)):
+        user = _user()
+        webhooks = _seed_webhooks(rows, user)
+        topic = _seed_topic(user, webhooks)
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            for webhook in webhooks:
+                client.post(reverse('write-webhook', args=[webhook.id]), {'event': 1}, format='json')
+            results['write_per_subscriber'] = _rate(rows, started)
+        results['write_per_subscriber']['queries'] = len(context)
+
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = client.post(reverse('publish-topic', args=[topic.id]), {'event': 2}, format='json')
+            results['publish'] = _rate(len(response.data['task_ids']), started)
+        results['publish']['queries'] = len(context)
+        transaction.set_rollback(True)
+    get_redis().delete(BENCHMARK_QUEUE)
+    return results
+
+
+def _drain_celery_worker(webhook, rows):
+    app = send_data_task.app
+    with celery_worker(app, [BENCHMARK_QUEUE]):
+        started, cpu_started = time.perf_counter(), time.process_time()
+        results = [
+            send_data_task.apply_async(({'index': index},), {'webhook_id': webhook.id}, queue=BENCHMARK_QUEUE)
+            for index in range(rows)
+        ]
+        for result in results:
+            result.get(timeout=60)
+        return _per_cpu(_rate(rows, started), cpu_started)
+
+
+def _drain_async_worker(webhook, rows):
+    worker = AsyncDeliveryWorker(queue_names=[BENCHMARK_QUEUE])
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    try:
+        started, cpu_started = time.perf_counter(), time.process_time()
+        results = [
+            send_data_task.apply_async(({'index': index},), {'webhook_id': webhook.id}, queue=BENCHMARK_QUEUE)
+            for index in range(rows)
+        ]
+        for result in results:
+            result.get(timeout=60)
+        return _per_cpu(_rate(rows, started), cpu_started)
+    finally:
+        worker.stop()
+        thread.join()
+
+
+def bench_worker(rows, latency=0.005):
+    # Workers run in threads of this process and read the webhook through their own connections,
+    # so the rows are committed here and removed afterwards instead of rolled back.
+    results = {}
+    user = _user()
+    try:
+        with StubReceiver(delay=latency) as receiver:
+            webhook = _webhook(user=user, target_url=receiver.url)
+            results['celery_solo'] = _drain_celery_worker(webhook, rows)
+            results['asyncio'] = _drain_async_worker(webhook, rows)
+    finally:
+        DeliveryAttempt.objects.filter(webhook__user=user).delete()
+        user.delete()
+        get_redis().delete(BENCHMARK_QUEUE)
+    return results
+
+
+def _hot_tenant_run(hot, cold, rows, queue_for, max_in_flight):
+    # The hot tenant's burst is queued first, every cold tenant then adds a few deliveries behind it.
+    with StubReceiver(delay=0.002) as receiver:
+        Webhook.objects.filter(id__in=[webhook.id for webhook in (hot, *cold)]).update(target_url=receiver.url)
+        publish = [(hot, index) for index in range(rows)]
+        publish.extend((webhook, index) for index in range(COLD_TENANT_DELIVERIES) for webhook in cold)
+        for webhook, index in publish:
+            send_data_task.apply_async(
+                ({'webhook': webhook.id, 'index': index},), {'webhook_id': webhook.id}, queue=queue_for(webhook)
+            )
+
+        worker = AsyncDeliveryWorker(
+            queue_names=sorted({queue_for(webhook) for webhook in (hot, *cold)}), max_in_flight=max_in_flight
+        )
+        thread = threading.Thread(target=worker.run)
+        started = time.time()
+        thread.start()
+        try:
+            while len(receiver.requests) < len(publish):
+                time.sleep(0.05)
+        finally:
+            worker.stop()
+            thread.join()
+
+    cold_latencies, hot_finished = [], started
+    for request in receiver.requests:
+        if codec.loads(request['body'])['webhook'] == hot.id:
+            hot_finished = max(hot_finished, request['received_at'])
+        else:
+            cold_latencies.append(request['received_at'] - started)
+    cold_latencies.sort()
+    return {
+        'cold_p50_ms': round(cold_latencies[len(cold_latencies) // 2] * 1000, 2),
+        'cold_p99_ms': round(cold_latencies[int(len(cold_latencies) * 0.99)] * 1000, 2),
+        'cold_max_ms': round(cold_latencies[-1] * 1000, 2),
+        'hot_drained_seconds': round(hot_finished - started, 4),
+        # Tenants hashed to the hot tenant's queue still wait behind its burst.
+        'cold_tenants_sharing_hot_queue': sum(queue_for(webhook) == queue_for(hot) for webhook in cold),
+    }
+
+
+def bench_fairness(rows, max_in_flight=20):
+    # A single FIFO queue against the sharded queues consumed with deficit round robin.
+    results = {}
+    users = _users(COLD_TENANTS + 1)
+    try:
+        hot, *cold = [_webhook(user=user) for user in users]
+        shards = {'WEBHOOK_DELIVERY_QUEUE': BENCHMARK_QUEUE, 'WEBHOOK_PRIORITY_QUEUE': f'{BENCHMARK_QUEUE}.priority'}
+        with override_settings(**shards):
+            results['fifo'] = _hot_tenant_run(hot, cold, rows, lambda webhook: BENCHMARK_QUEUE, max_in_flight)
+            results['sharded_drr'] = _hot_tenant_run(
+                hot, cold, rows, lambda webhook: delivery_queue(webhook.user_id), max_in_flight
+            )
+    finally:
+        DeliveryAttempt.objects.filter(webhook__user__in=users).delete()
+        User.objects.filter(id__in=[user.id for user in users]).delete()
+    return results
+
+
+def _write_events(webhook, rows, run, concurrency=50):
+    factory = AsyncRequestFactory()
+    view = _AsyncWebhookWriteView.as_view()
+
+    async def load():
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one(index):
+            async with limit:
+                request = factory.post(
+                    f'/webhook/{webhook.id}/write/', {'run': run, 'index': index}, content_type='application/json'
+                )
+                force_authenticate(request, user=webhook.user)
+                response = await view(request, webhook_id=webhook.id)
+                await sync_to_async(response.render)()
+
+        await asyncio.gather(*(one(index) for index in range(rows)))
+
+    async_to_sync(load)()
+
+
+def _coalescing_run(webhook, rows, receiver, run):
+    # Each run sends its own bodies, so idempotency does not replay the previous run's writes.
+    received = len(receiver.requests)
+    started = time.perf_counter()
+    _write_events(webhook, rows, run)
+    while DeliveryAttempt.objects.filter(webhook=webhook, status=DeliveryAttempt.DELIVERED).count() < rows:
+        time.sleep(0.05)
+    result = _rate(rows, started)
+    result['deliveries'] = len(receiver.requests) - received
+    DeliveryAttempt.objects.filter(webhook=webhook).delete()
+    return result
+
+
+def bench_coalescing(rows, latency=0.005, window=0.2):
+    # Events per second end to end, from the write endpoint to the receiver, through one solo Celery worker.
+    results = {}
+    user = _user()
+    # The view queues its flushes on BENCHMARK_QUEUE, the flushes route their deliveries there too.
+    routing = {**_benchmark_routing(), **_unthrottled(rows * 2)}
+    try:
+        with StubReceiver(delay=latency) as receiver, override_settings(**routing), \
+                celery_worker(send_data_task.app, [BENCHMARK_QUEUE]):
+            webhook = _webhook(user=user, target_url=receiver.url)
+            results['per_event'] = _coalescing_run(webhook, rows, receiver, 'per_event')
+            webhook.batch_window = timedelta(seconds=window)
+            webhook.save()
+            results['batched'] = _coalescing_run(webhook, rows, receiver, 'batched')
+    finally:
+        user.delete()
+        get_redis().delete(BENCHMARK_QUEUE)
+    return results
+
+
+def _down_receiver_run(webhook, rows, receiver):
+    received = len(receiver.requests)
+    with patch('myapp.retries.schedule_retry') as mock_schedule_retry:
+        started = time.perf_counter()
+        for index in range(rows):
+            send_data_task.apply(({'index': index},), {'webhook_id': webhook.id})
+        result = _rate(rows, started)
+    result['attempts'] = len(receiver.requests) - received
+    result['parked'] = sum(1 for call in mock_schedule_retry.call_args_list if call.args[3] == 0)
+    return result
+
+
+def bench_breaker(rows, latency=0.02):
+    # Worker time spent on a receiver that answers 503 slowly, with the circuit breaker off and on.
+    # Retries are not scheduled, only the first run of each delivery is measured.
+    results = {}
+    with transaction.atomic(), StubReceiver(status=503, delay=latency) as receiver:
+        webhook = _webhook(target_url=receiver.url)
+        with override_settings(WEBHOOK_BREAKER_FAILURE_RATE=0):
+            results['no_breaker'] = _down_receiver_run(webhook, rows, receiver)
+        results['breaker'] = _down_receiver_run(webhook, rows, receiver)
+        breaker.reset([breaker.breaker_host(receiver.url)])
+        transaction.set_rollback(True)
+    return results
+
+
+DATA_FILTERS = {
+    'contains': {'contains': '{"type": "type-7"}'},
+    'contains_nested': {'contains': '{"items": [{"sku": "sku-42"}]}'},
+    'has_key': {'has_key': 'flagged'},
+}
+
+
+def bench_data_filters(rows, repeat=20):
+    # Each filter as the list endpoint runs it, with its plan, against filtering the whole table client side.
+    results = {}
+    with transaction.atomic():
+        user = _user()
+        webhooks = _build_webhooks(rows, user)
+        for index, webhook in enumerate(webhooks):
+            webhook.data = {'type': f'type-{index % 100}', 'items': [{'sku': f'sku-{index % 1000}'}]}
+            if index % 1000 == 0:
+                webhook.data['flagged'] = True
+        Webhook.objects.bulk_create(webhooks, batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE myapp_webhook')
+
+        for name, params in DATA_FILTERS.items():
+            queryset = filter_data(Webhook.objects.filter(user=user), QueryDict(urlencode(params)))
+            plan = queryset.explain()
+            started = time.perf_counter()
+            for _ in range(repeat):
+                matched = len(queryset.values_list('id', flat=True))
+            results[name] = {
+                'matched': matched,
+                'ms_per_query': round((time.perf_counter() - started) / repeat * 1000, 3),
+                'seq_scan': 'Seq Scan' in plan,
+            }
+
+        started = time.perf_counter()
+        matched = sum(1 for data in Webhook.objects.filter(user=user).values_list('data', flat=True).iterator()
+                      if data.get('type') == 'type-7')
+        results['client_side'] = {'matched': matched, 'ms_per_query': round((time.perf_counter() - started) * 1000, 3)}
+        transaction.set_rollback(True)
+    return results
+
+
+def bench_retention(rows):
+    # Runs under its own lock and high-water mark keys with the archive off, so a benchmark leaves neither
+    # the next real retention run nor the archive any different.
+    results = {}
+    run_id = uuid.uuid4()
+    keys = {'HIGH_WATER_MARK_KEY': f'benchmark:{run_id}:high-water-mark', 'LOCK_KEY': f'benchmark:{run_id}:lock'}
+    with transaction.atomic(), override_settings(WEBHOOK_ARCHIVE_DIR=None), patch.multiple(retention, **keys):
+        user = _user()
+        _seed_webhooks(rows, user)
+        Webhook.objects.filter(user=user).update(created_at=timezone.now() - timedelta(days=30))
+
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            stats = retention.run_retention()
+        cache.delete_many(keys.values())
+        results['delete_old_webhooks'] = _rate(stats['deleted'], started)
+        results['delete_old_webhooks'].update(chunks=stats['chunks'], queries=len(context))
+        transaction.set_rollback(True)
+    return results
+
+
+def bench_archive(rows, users=ARCHIVE_USERS):
+    # Archiving rate and size against the rows in Postgres, then reading one tenant back out of the segments.
+    results = {}
+    with transaction.atomic(), tempfile.TemporaryDirectory() as directory, \
+            override_settings(WEBHOOK_ARCHIVE_DIR=directory):
+        tenants = _users(users)
+        for tenant in tenants:
+            _seed_webhooks(rows // users, tenant)
+        ids = list(Webhook.objects.filter(user__in=tenants).values_list('id', flat=True))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT sum(pg_column_size(w.*)) FROM myapp_webhook w WHERE id = ANY(%s)', [ids])
+            table_bytes = cursor.fetchone()[0]
+
+        started = time.perf_counter()
+        archive_webhooks(ids)
+        results['archive'] = _rate(len(ids), started)
+        archive_bytes = sum(os.path.getsize(path) for path in glob(os.path.join(directory, '*', '*')))
+        results['archive'].update(
+            bytes_per_row=round(archive_bytes / len(ids), 1), table_bytes_per_row=round(table_bytes / len(ids), 1),
+        )
+
+        started = time.perf_counter()
+        matched = sum(chunk.count(b'\n') for chunk in read_archive([tenants[0].id]))
+        results['query_one_user'] = {'matched': matched, 'ms': round((time.perf_counter() - started) * 1000, 3)}
+        transaction.set_rollback(True)
+    return results
+
+BENCHMARKS = {
+    'ingest': bench_ingest,
+    'delivery': bench_delivery,
+    'async_delivery': bench_async_delivery,
+    'api_latency': bench_api_latency,
+    'codec': bench_codec,
+    'endpoints': bench_endpoints,
+    'worker': bench_worker,
+    'fairness': bench_fairness,
+    'fanout': bench_fanout,
+    'data_filters': bench_data_filters,
+    'coalescing': bench_coalescing,
+    'breaker': bench_breaker,
+    'retention': bench_retention,
+    'archive': bench_archive,
+}
+
+
+def over_budget(results):
+    endpoints = results.get('endpoints', {})
+    return sorted(name for name, result in endpoints.items() if not result['within_budget'])
+
+
+def compare_results(baseline, current, path=''):
+    # Flattens both runs to their numeric leaves, for diffing two commits.
+    changes = {}
+    for key, value in current.items():
+        name = f'{path}.{key}' if path else key
+        before = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            changes.update(compare_results(before or {}, value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(before, (int, float)):
+            changes[name] = {
+                'baseline': before,
+                'current': value,
+                'change': round((value - before) / before, 4) if before else None,
+            }
+    return changes
@@ -0,0 +1,140 @@
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.utils import timezone
+
+from myapp.metrics import BREAKER_TRANSITIONS
+from myapp.models import CircuitBreaker
+from myapp.redis_client import get_redis
+from myapp.throttling import LocalBlocklist
+
+BREAKER_KEY = 'webhook:breaker:{}'
+
+# Lets a delivery through unless the breaker is open. Once the open period is over it goes half open
+# and lets one probe through per probe timeout, so a probe that never reports back cannot wedge it.
+# Returns the seconds to wait as a string, and the new state when this call changed it.
+ALLOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local state, retry_at = unpack(redis.call('HMGET', KEYS[1], 'state', 'retry_at'))
+if state ~= 'open' and state ~= 'half_open' then
+    return {'0', ''}
+end
+retry_at = tonumber(retry_at) or 0
+if now < retry_at then
+    return {tostring(retry_at - now), ''}
+end
+redis.call('HSET', KEYS[1], 'state', 'half_open', 'retry_at', now + tonumber(ARGV[2]))
+if state == 'open' then
+    return {'0', 'half_open'}
+end
+return {'0', ''}
+"""
+
+# Counts outcomes over a fixed window while closed and opens on the failure rate. While half open a failed
+# probe opens it again and enough probes in a row close it. Returns the new state, requests and failures.
+RECORD_SCRIPT = """
+local now = tonumber(ARGV[1])
+local success = tonumber(ARGV[2])
+local state = redis.call('HGET', KEYS[1], 'state')
+if state == 'open' then
+    return {'', 0, 0}
+end
+if state == 'half_open' then
+    if success == 0 then
+        redis.call('HSET', KEYS[1], 'state', 'open', 'retry_at', now + tonumber(ARGV[6]), 'probes', 0)
+        return {'open', 0, 0}
+    end
+    if redis.call('HINCRBY', KEYS[1], 'probes', 1) >= tonumber(ARGV[7]) then
+        redis.call('DEL', KEYS[1])
+        return {'closed', 0, 0}
+    end
+    redis.call('HSET', KEYS[1], 'retry_at', 0)
+    return {'', 0, 0}
+end
+local window_start = tonumber(redis.call('HGET', KEYS[1], 'window_start'))
+if not window_start or now - window_start >= tonumber(ARGV[3]) then
+    redis.call('HSET', KEYS[1], 'window_start', now, 'requests', 0, 'failures', 0)
+end
+local requests = redis.call('HINCRBY', KEYS[1], 'requests', 1)
+local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1 - success)
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3])) * 2)
+if requests >= tonumber(ARGV[4]) and failures / requests >= tonumber(ARGV[5]) then
+    redis.call('HSET', KEYS[1], 'state', 'open', 'retry_at', now + tonumber(ARGV[6]), 'probes', 0)
+    redis.call('PERSIST', KEYS[1])
+    return {'open', requests, failures}
+end
+return {'', requests, failures}
+"""
+
+
+def breaker_host(target_url):
+    # One breaker per receiving host, shared by every webhook that delivers there.
+    # Built from hostname and port, so credentials in the URL never end up in the key or the admin.
+    parts = urlsplit(target_url)
+    host = parts.hostname or ''
+    if ':' in host:
+        host = f'[{host}]'
+    return f'{host}:{parts.port}' if parts.port else host
+
+
+local_open = None
+
+
+def _local_open():
+    global local_open
+
+    if local_open is None:
+        local_open = LocalBlocklist()
+    return local_open
+
+
+def _mirror(host, state, requests=0, failures=0):
+    BREAKER_TRANSITIONS.labels(state).inc()
+    defaults = {'state': state, 'requests': requests, 'failures': failures}
+    if state == CircuitBreaker.OPEN:
+        defaults['opened_at'] = timezone.now()
+    CircuitBreaker.objects.update_or_create(host=host, defaults=defaults)
+
+
+def allow(host):
+    # Returns 0 when the delivery may run, otherwise the seconds until the breaker takes a probe.
+    if not settings.WEBHOOK_BREAKER_FAILURE_RATE:
+        return 0
+    wait = _local_open().wait([host])
+    if wait > 0:
+        return wait
+
+    wait, state = get_redis().eval(
+        ALLOW_SCRIPT, 1, BREAKER_KEY.format(host), time.time(), settings.WEBHOOK_BREAKER_PROBE_TIMEOUT,
+    )
+    wait = float(wait)
+    if wait > 0:
+        # Bounded, so a breaker closed from the admin is seen again soon.
+        _local_open().block(host, min(wait, settings.WEBHOOK_BREAKER_LOCAL_TTL))
+    if state:
+        _mirror(host, state.decode())
+    return wait
+
+
+def record(host, success):
+    if not settings.WEBHOOK_BREAKER_FAILURE_RATE:
+        return None
+    state, requests, failures = get_redis().eval(
+        RECORD_SCRIPT, 1, BREAKER_KEY.format(host), time.time(), int(success),
+        settings.WEBHOOK_BREAKER_WINDOW, settings.WEBHOOK_BREAKER_MIN_REQUESTS, settings.WEBHOOK_BREAKER_FAILURE_RATE,
+        settings.WEBHOOK_BREAKER_OPEN_SECONDS, settings.WEBHOOK_BREAKER_PROBES,
+    )
+    state = state.decode()
+    if not state:
+        return None
+    _mirror(host, state, requests, failures)
+    return state
+
+
+def reset(hosts):
+    hosts = list(hosts)
+    if hosts:
+        get_redis().delete(*(BREAKER_KEY.format(host) for host in hosts))
+        _local_open().clear()
+        CircuitBreaker.objects.filter(host__in=hosts).update(state=CircuitBreaker.CLOSED, requests=0, failures=0)
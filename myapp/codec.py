@@ -0,0 +1,61 @@
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from kombu.serialization import register
+
+CONTENT_TYPE = 'application/x-webhook-json'
+
+# orjson reads integers beyond 64 bits as floats. Any run of 19 digits might be one, only those
+# documents are left to the standard library, which keeps them exact.
+_LONG_DIGITS = re.compile(r'\d{19}')
+_LONG_DIGITS_BYTES = re.compile(rb'\d{19}')
+
+# Both backends produce the same bytes: compact separators, UTF-8 instead of \u escapes.
+if orjson is not None:
+    BACKEND = 'orjson'
+
+    def dumps(value):
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            # Integers beyond 64 bits and non-string keys, which the standard library accepts.
+            return _std_dumps(value)
+
+    def canonical_dumps(value):
+        try:
+            return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            return _std_dumps(value, sort_keys=True)
+
+    def loads(value):
+        pattern = _LONG_DIGITS if isinstance(value, str) else _LONG_DIGITS_BYTES
+        if pattern.search(value):
+            return json.loads(value)
+        return orjson.loads(value)
+else:
+    BACKEND = 'json'
+
+    def dumps(value):
+        return _std_dumps(value)
+
+    def canonical_dumps(value):
+        return _std_dumps(value, sort_keys=True)
+
+    loads = json.loads
+
+
+def _std_dumps(value, sort_keys=False):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, sort_keys=sort_keys).encode('utf-8')
+
+
+def dumps_str(value):
+    return dumps(value).decode('utf-8')
+
+
+def register_kombu_serializer():
+    register('webhook-json', dumps, loads, content_type=CONTENT_TYPE, content_encoding='utf-8')
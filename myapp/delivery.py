@@ -0,0 +1,146 @@
+import hashlib
+import os
+
+import urllib3
+from django.conf import settings
+
+from myapp import breaker, codec
+from myapp.metrics import DELIVERY_DURATION
+from myapp.models import DeliveryAttempt, RetryPolicy, Webhook
+from myapp.payloads import load_payload
+from myapp.routing import delivery_queue
+
+_pool = None
+_pool_pid = None
+
+
+# Statuses a receiver answers while it cannot take the delivery right now, every other 4xx is final.
+RETRYABLE_STATUSES = {408, 429}
+
+
+class DeliveryError(Exception):
+
+    def __init__(self, message, status=None, permanent=False):
+        super().__init__(message)
+        self.status = status
+        self.permanent = permanent
+
+
+def get_pool():
+    global _pool, _pool_pid
+
+    # Prefork workers inherit the parent's module state, sockets must not be shared across processes.
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = urllib3.PoolManager(
+            num_pools=settings.WEBHOOK_DELIVERY_NUM_POOLS,
+            maxsize=settings.WEBHOOK_DELIVERY_POOL_MAXSIZE,
+            timeout=urllib3.Timeout(
+                connect=settings.WEBHOOK_DELIVERY_CONNECT_TIMEOUT,
+                read=settings.WEBHOOK_DELIVERY_READ_TIMEOUT,
+            ),
+            retries=False,
+            headers={'Content-Type': 'application/json'},
+        )
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def deliver(url, body, headers=None):
+    try:
+        response = get_pool().request('POST', url, body=body, headers=headers)
+    except urllib3.exceptions.HTTPError as exc:
+        raise DeliveryError(f'Delivery to {url} failed: {exc}') from exc
+
+    return check_status(response.status)
+
+
+def is_rejection(status):
+    # The receiver answered but turned this one delivery down. The breaker is shared by every tenant delivering
+    # to the host, so a tenant's bad requests must not count as the host failing.
+    return status is not None and 400 <= status < 500 and status not in RETRYABLE_STATUSES
+
+
+def check_status(status):
+    if status >= 500 or status in RETRYABLE_STATUSES:
+        raise DeliveryError(f'Receiver responded with {status}', status=status)
+    if is_rejection(status):
+        raise DeliveryError(f'Receiver rejected the delivery with {status}', status=status, permanent=True)
+    return status
+
+
+class Delivery:
+
+    def __init__(self, webhook_id, body, payload=None, events=None):
+        self.webhook_id = webhook_id
+        self.payload = payload
+        self.events = events
+        self.body = body
+        self.md5 = hashlib.md5(body or b'').hexdigest()
+        self.exists = False
+        self.target_url = None
+        self.queue = None
+        self.retry_policy = RetryPolicy.default()
+
+    @property
+    def headers(self):
+        headers = {'X-Webhook-Id': str(self.webhook_id), 'X-Payload-MD5': self.md5}
+        if self.events is not None:
+            headers['X-Webhook-Batch-Size'] = str(len(self.events))
+        return headers
+
+    @property
+    def host(self):
+        return breaker.breaker_host(self.target_url)
+
+    @property
+    def data(self):
+        return codec.loads(self.body)
+
+    @property
+    def skip_reason(self):
+        if self.body is None:
+            return 'Payload not found'
+        if not self.target_url:
+            return 'Webhook has no target URL'
+        return None
+
+    def result(self, status):
+        return {'status': status, 'md5': self.md5}
+
+
+def prepare_delivery(data, webhook_id=None, payload=None, events=None):
+    if payload is not None:
+        delivery = Delivery(webhook_id, load_payload(payload), payload=payload, events=events)
+    else:
+        delivery = Delivery(webhook_id, codec.canonical_dumps(data))
+    webhook = Webhook.objects.select_related('retry_policy').defer('data').filter(id=webhook_id).first()
+    if webhook is not None:
+        delivery.exists = True
+        delivery.target_url = webhook.target_url
+        delivery.queue = delivery_queue(webhook.user_id, webhook.priority)
+        delivery.retry_policy = webhook.retry_policy or delivery.retry_policy
+    return delivery
+
+
+def record_attempt(delivery, task_id, attempt, status, latency=None, response_code=None, error=''):
+    if latency is not None:
+        DELIVERY_DURATION.labels(status).observe(latency)
+        # Only attempts that reached out to the receiver count towards its breaker.
+        breaker.record(delivery.host, status == DeliveryAttempt.DELIVERED or is_rejection(response_code))
+    if not delivery.exists:
+        return None
+    fields = {
+        'webhook_id': delivery.webhook_id,
+        'attempt': attempt,
+        'status': status,
+        'response_code': response_code,
+        'latency_ms': None if latency is None else round(latency * 1000, 3),
+        'payload_digest': delivery.md5,
+        'error': error,
+    }
+    if delivery.events is not None:
+        # A batch answers for each of its events, under the task id their write returned.
+        return DeliveryAttempt.objects.bulk_create([
+            DeliveryAttempt(task_id=event, batch_id=task_id or '', **fields) for event in delivery.events
+        ])
+    return DeliveryAttempt.objects.create(task_id=task_id or '', **fields)
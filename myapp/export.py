@@ -0,0 +1,68 @@
+import csv
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import TextField
+from django.db.models.functions import Cast
+
+from myapp import codec
+
+EXPORT_FIELDS = ['id', 'created_at', 'target_url', 'data']
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class _Echo:
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset):
+    # Postgres renders the jsonb column as text, so rows are never decoded into Python objects.
+    return queryset.order_by('created_at', 'id').annotate(data_text=Cast('data', TextField())).values_list(
+        'id', 'created_at', 'target_url', 'data_text'
+    )
+
+
+def _encoder(export_format):
+    if export_format == 'csv':
+        writer = csv.writer(_Echo())
+        return lambda row: writer.writerow([row[0], row[1].isoformat(), row[2], row[3]]).encode('utf-8')
+    return lambda row: (
+        f'{{"id": {row[0]}, "created_at": "{row[1].isoformat()}", "target_url": {codec.dumps_str(row[2])}, '
+        f'"data": {row[3]}}}\n'
+    ).encode('utf-8')
+
+
+def _header(export_format):
+    if export_format == 'csv':
+        return csv.writer(_Echo()).writerow(EXPORT_FIELDS).encode('utf-8')
+    return b''
+
+
+def iter_export(queryset, export_format, chunk_size=None):
+    chunk_size = chunk_size or settings.WEBHOOK_EXPORT_CHUNK_SIZE
+    encode = _encoder(export_format)
+    lines = [_header(export_format)]
+    for row in export_rows(queryset).iterator(chunk_size=chunk_size):
+        lines.append(encode(row))
+        if len(lines) >= chunk_size:
+            yield b''.join(lines)
+            lines = []
+    if lines:
+        yield b''.join(lines)
+
+
+async def aiter_export(queryset, export_format, chunk_size=None):
+    # Under ASGI a sync iterator would be read into a list before the first byte is sent. The cursor is
+    # still driven from the sync thread, Django 4.2's aiterator() runs values_list() queries on the loop.
+    chunks = iter_export(queryset, export_format, chunk_size)
+    next_chunk = sync_to_async(next)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
@@ -0,0 +1,20 @@
+from django.db import models
+from django.db.backends.postgresql.psycopg_any import Jsonb
+
+from myapp import codec
+
+
+class CodecJSONField(models.JSONField):
+
+    def from_db_value(self, value, expression, connection):
+        if not isinstance(value, str) or self.decoder is not None:
+            return super().from_db_value(value, expression, connection)
+        try:
+            return codec.loads(value)
+        except ValueError:
+            return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if connection.vendor != 'postgresql' or self.encoder is not None or hasattr(value, 'as_sql'):
+            return super().get_db_prep_value(value, connection, prepared)
+        return Jsonb(value, dumps=codec.dumps_str)
@@ -0,0 +1,52 @@
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from myapp import codec
+
+
+def parse_datetime_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: 'Expected an ISO 8601 datetime.'})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def filter_created_range(queryset, params):
+    since = parse_datetime_param(params, 'since')
+    until = parse_datetime_param(params, 'until')
+    if since:
+        queryset = queryset.filter(created_at__gte=since)
+    if until:
+        queryset = queryset.filter(created_at__lt=until)
+    return queryset
+
+
+def parse_json_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = codec.loads(value)
+    except ValueError:
+        parsed = None
+    if not isinstance(parsed, (dict, list)):
+        raise ValidationError({name: 'Expected a JSON object or array.'})
+    return parsed
+
+
+def filter_data(queryset, params):
+    contains = parse_json_param(params, 'contains')
+    if contains is not None:
+        queryset = queryset.filter(data__contains=contains)
+    for key in params.getlist('has_key'):
+        queryset = queryset.filter(data__has_key=key)
+    return queryset
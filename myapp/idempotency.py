@@ -0,0 +1,30 @@
+from django.conf import settings
+
+from myapp.redis_client import get_async_redis
+
+IDEMPOTENCY_KEY = 'webhook:idempotency:{}:{}'
+MAX_KEY_LENGTH = 255
+
+
+def write_key(request, digest):
+    # The digest is the payload's, over canonical JSON, so key order and whitespace do not make an event look new.
+    key = request.headers.get('Idempotency-Key')
+    if key is not None:
+        return f'key:{key}'
+    if settings.WEBHOOK_DEDUPLICATE_PAYLOADS:
+        return f'digest:{digest}'
+    return None
+
+
+async def aclaim(webhook_id, key, task_id):
+    # Returns the task id already holding the key, None when this write claimed it.
+    client = get_async_redis()
+    redis_key = IDEMPOTENCY_KEY.format(webhook_id, key)
+    if await client.set(redis_key, task_id, nx=True, ex=settings.WEBHOOK_IDEMPOTENCY_TTL):
+        return None
+    existing = await client.get(redis_key)
+    return existing.decode() if existing is not None else None
+
+
+async def arelease(webhook_id, key):
+    await get_async_redis().delete(IDEMPOTENCY_KEY.format(webhook_id, key))
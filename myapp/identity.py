@@ -0,0 +1,196 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from jose import JWTError, jwt
+from keycloak import KeycloakOpenID
+from keycloak.exceptions import KeycloakError
+
+from . import codec
+from .schemas import UserInfo
+
+logger = logging.getLogger(__name__)
+
+_keycloak_openid = None
+
+
+class TokenError(Exception):
+    pass
+
+
+class KeysUnavailable(Exception):
+    pass
+
+
+def get_keycloak_openid():
+    global _keycloak_openid
+
+    if _keycloak_openid is None:
+        _keycloak_openid = KeycloakOpenID(
+            server_url=settings.KEYCLOAK_SERVER_URL,
+            client_id=settings.KEYCLOAK_CLIENT_ID,
+            realm_name=settings.KEYCLOAK_REALM,
+            client_secret_key=settings.KEYCLOAK_CLIENT_SECRET
+        )
+    return _keycloak_openid
+
+
+def fetch_jwks():
+    return get_keycloak_openid().certs()
+
+
+class JWKSCache:
+
+    def __init__(self, ttl=None, min_refresh_interval=None):
+        self.ttl = ttl or settings.KEYCLOAK_JWKS_TTL
+        self.min_refresh_interval = min_refresh_interval or settings.KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL
+        self._keys = {}
+        self._fetched_at = None
+        self._retry_at = 0
+        self._lock = threading.Lock()
+
+    def get_key(self, kid):
+        now = time.monotonic()
+        if now >= self._retry_at:
+            if self._fetched_at is None or now - self._fetched_at > self.ttl:
+                self._refresh(now)
+            elif kid not in self._keys and now - self._fetched_at > self.min_refresh_interval:
+                # Keycloak rotated its keys. The interval keeps tokens with made-up kids from hammering it.
+                self._refresh(now)
+        if not self._keys and self._retry_at > now:
+            raise KeysUnavailable('Keycloak signing keys are unavailable')
+        return self._keys.get(kid)
+
+    def _refresh(self, now):
+        with self._lock:
+            if self._fetched_at is not None and self._fetched_at >= now or self._retry_at > now:
+                return
+            try:
+                keys = fetch_jwks().get('keys', [])
+            except KeycloakError as exc:
+                # The cached keys stay in use, and Keycloak is not asked again before the interval is over.
+                logger.warning('Could not refresh the Keycloak JWKS: %s', exc)
+                self._retry_at = time.monotonic() + self.min_refresh_interval
+                return
+            self._keys = {key['kid']: key for key in keys if 'kid' in key}
+            self._fetched_at = time.monotonic()
+
+
+class ClaimsCache:
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or settings.KEYCLOAK_CLAIMS_CACHE_SIZE
+        self._claims = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            claims = self._claims.get(token)
+            if claims is None:
+                return None
+            if claims['exp'] <= time.time():
+                del self._claims[token]
+                return None
+            self._claims.move_to_end(token)
+            return claims
+
+    def set(self, token, claims):
+        with self._lock:
+            self._claims[token] = claims
+            self._claims.move_to_end(token)
+            while len(self._claims) > self.max_size:
+                self._claims.popitem(last=False)
+
+
+jwks_cache = None
+claims_cache = None
+
+
+def verify_token(token):
+    global jwks_cache, claims_cache
+
+    if jwks_cache is None:
+        jwks_cache, claims_cache = JWKSCache(), ClaimsCache()
+
+    claims = claims_cache.get(token)
+    if claims is not None:
+        return claims
+
+    try:
+        header = jwt.get_unverified_header(token)
+        key = jwks_cache.get_key(header.get('kid'))
+        if key is None:
+            raise TokenError('Token is signed with an unknown key')
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=settings.KEYCLOAK_JWT_ALGORITHMS,
+            issuer=settings.KEYCLOAK_ISSUER,
+            options={'verify_aud': False, 'require_exp': True, 'require_iss': True},
+        )
+    except JWTError as exc:
+        raise TokenError(str(exc)) from exc
+    _check_claims(claims)
+
+    claims_cache.set(token, claims)
+    return claims
+
+
+def _check_claims(claims):
+    # Keycloak puts the requesting client in azp, aud only names it when an audience mapper is configured.
+    if claims.get('typ') != settings.KEYCLOAK_TOKEN_TYPE:
+        raise TokenError(f"Expected a {settings.KEYCLOAK_TOKEN_TYPE} token, got {claims.get('typ')}")
+    audience = claims.get('aud') or []
+    audience = [audience] if isinstance(audience, str) else audience
+    if claims.get('azp') != settings.KEYCLOAK_AUDIENCE and settings.KEYCLOAK_AUDIENCE not in audience:
+        raise TokenError('Token was not issued for this client')
+    if not claims.get('preferred_username'):
+        raise TokenError('Token has no preferred_username')
+
+
+def _user_fields(user_info):
+    groups = user_info.get('group') or []
+    is_superuser = '/superuser' in groups
+    return {
+        'email': user_info.get('email') or '',
+        'first_name': user_info.get('given_name') or '',
+        'last_name': user_info.get('family_name') or '',
+        'is_superuser': is_superuser,
+        'is_staff': '/staff' in groups or is_superuser,
+    }
+
+
+def _user_cache_key(username):
+    return f'keycloak:user:{username}'
+
+
+def sync_user(user_info: dict) -> User:
+    username = user_info.get('preferred_username')
+    fields = _user_fields(user_info)
+    digest = hashlib.sha256(codec.canonical_dumps([username, fields])).hexdigest()
+
+    cached = cache.get(_user_cache_key(username))
+    if cached is not None and cached[0] == digest:
+        return cached[1]
+
+    userinfo = UserInfo(**user_info)
+    user, created = User.objects.get_or_create(username=userinfo.preferred_username, defaults=fields)
+    if not created and any(getattr(user, name) != value for name, value in fields.items()):
+        User.objects.filter(pk=user.pk).update(**fields)
+        for name, value in fields.items():
+            setattr(user, name, value)
+
+    cache.set(_user_cache_key(username), (digest, user), timeout=settings.KEYCLOAK_USER_CACHE_TTL)
+    return user
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    cache.delete(_user_cache_key(instance.username))
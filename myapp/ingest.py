@@ -0,0 +1,58 @@
+import io
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection, models, transaction
+
+from myapp import codec
+from myapp.models import Webhook
+
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def bulk_create_webhooks(user, items):
+    webhooks = [Webhook(user=user, **item) for item in items]
+    if not webhooks:
+        return webhooks
+
+    if connection.vendor == 'postgresql' and len(webhooks) >= settings.WEBHOOK_COPY_THRESHOLD:
+        _copy_webhooks(webhooks)
+    else:
+        Webhook.objects.bulk_create(webhooks, batch_size=settings.WEBHOOK_BULK_BATCH_SIZE)
+    return webhooks
+
+
+def _copy_value(field, value):
+    if value is None:
+        return '\\N'
+    if isinstance(field, models.JSONField):
+        value = codec.dumps_str(value)
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, timedelta):
+        value = f'{value.total_seconds()} seconds'
+    return str(value).translate(COPY_ESCAPES)
+
+
+@transaction.atomic
+def _copy_webhooks(webhooks):
+    table = Webhook._meta.db_table
+    fields = [field for field in Webhook._meta.concrete_fields if not field.primary_key]
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+
+    with connection.cursor() as cursor:
+        # COPY cannot return generated keys, so ids are reserved from the sequence up front.
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+            [table, len(webhooks)],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+
+        buffer = io.StringIO()
+        for webhook_id, webhook in zip(ids, webhooks):
+            webhook.id = webhook_id
+            values = [str(webhook_id)] + [_copy_value(field, field.pre_save(webhook, add=True)) for field in fields]
+            buffer.write('\t'.join(values) + '\n')
+        buffer.seek(0)
+
+        cursor.copy_expert(f'COPY {table} (id, {columns}) FROM STDIN', buffer)
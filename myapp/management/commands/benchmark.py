@@ -0,0 +1,57 @@
+import json
+import platform
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from myapp.benchmarks import BENCHMARKS, compare_results, over_budget
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Runs the webhook pipeline benchmarks and prints the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f'Benchmarks to run: {", ".join(BENCHMARKS)}')
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--output', help='Also write the results to this file')
+        parser.add_argument('--compare', help='Results file of an earlier run to report changes against')
+        parser.add_argument('--check', action='store_true', help='Fail when an endpoint exceeds its query budget')
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f'Unknown benchmarks: {", ".join(sorted(unknown))}')
+
+        results = {name: BENCHMARKS[name](options['rows']) for name in names}
+        report = {
+            'meta': {
+                'commit': _commit(),
+                'created_at': timezone.now().isoformat(),
+                'rows': options['rows'],
+                'python': platform.python_version(),
+            },
+            'results': results,
+        }
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                report['changes'] = compare_results(json.load(baseline)['results'], results)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        self.stdout.write(output)
+
+        if options['check'] and over_budget(results):
+            raise CommandError(f'Query budget exceeded: {", ".join(over_budget(results))}')
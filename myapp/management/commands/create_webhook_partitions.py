@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.partitions import convert_to_partitioned, ensure_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    help = 'Creates hourly myapp_webhook partitions ahead of time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=None, help='Hours to create ahead of now')
+        parser.add_argument('--convert', action='store_true', help='Partition the table first if it is not yet')
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            if not options['convert']:
+                raise CommandError('myapp_webhook is not partitioned, run with --convert to partition it')
+            convert_to_partitioned()
+            self.stdout.write('Converted myapp_webhook to a partitioned table')
+
+        created = ensure_partitions(ahead=options['ahead'])
+        self.stdout.write(f'{len(created)} partitions are in place')
@@ -0,0 +1,44 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from myapp.export import CONTENT_TYPES, iter_export
+from myapp.filters import filter_created_range
+from myapp.models import Webhook
+
+
+class Command(BaseCommand):
+    help = 'Streams webhooks as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(CONTENT_TYPES), default='ndjson')
+        parser.add_argument('--user', action='append', help='Only webhooks of these usernames')
+        parser.add_argument('--since', help='Only webhooks created at or after this ISO 8601 datetime')
+        parser.add_argument('--until', help='Only webhooks created before this ISO 8601 datetime')
+        parser.add_argument('--output', help='File to write to instead of stdout')
+        parser.add_argument('--chunk-size', type=int)
+
+    def handle(self, *args, **options):
+        queryset = Webhook.objects.all()
+        if options['user']:
+            users = User.objects.filter(username__in=options['user'])
+            missing = set(options['user']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f'Unknown users: {", ".join(sorted(missing))}')
+            queryset = queryset.filter(user__in=users)
+        try:
+            queryset = filter_created_range(queryset, options)
+        except ValidationError as exc:
+            raise CommandError(exc.detail)
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in iter_export(queryset, options['format'], options['chunk_size']):
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
@@ -0,0 +1,44 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from myapp.archive import archive_enabled, read_archive
+from myapp.filters import parse_datetime_param
+
+
+class Command(BaseCommand):
+    help = 'Streams archived webhooks as NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', help='Only webhooks of these usernames')
+        parser.add_argument('--since', help='Only webhooks created at or after this ISO 8601 datetime')
+        parser.add_argument('--until', help='Only webhooks created before this ISO 8601 datetime')
+        parser.add_argument('--output', help='File to write to instead of stdout')
+
+    def handle(self, *args, **options):
+        if not archive_enabled():
+            raise CommandError('WEBHOOK_ARCHIVE_DIR is not set')
+        user_ids = None
+        if options['user']:
+            users = dict(User.objects.filter(username__in=options['user']).values_list('username', 'id'))
+            missing = set(options['user']) - set(users)
+            if missing:
+                raise CommandError(f'Unknown users: {", ".join(sorted(missing))}')
+            user_ids = list(users.values())
+        try:
+            since = parse_datetime_param(options, 'since')
+            until = parse_datetime_param(options, 'until')
+        except ValidationError as exc:
+            raise CommandError(exc.detail)
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in read_archive(user_ids, since, until):
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
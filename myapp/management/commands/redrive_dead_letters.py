@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from myapp.filters import parse_datetime_param
+from myapp.models import DeadLetter
+from myapp.retries import redrive_dead_letters
+
+
+class Command(BaseCommand):
+    help = 'Re-enqueues dead-lettered deliveries that have not been redriven yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--webhook', type=int, action='append', help='Only these webhook ids')
+        parser.add_argument('--since', help='Only dead letters created at or after this ISO 8601 datetime')
+
+    def handle(self, *args, **options):
+        queryset = DeadLetter.objects.all()
+        if options['webhook']:
+            queryset = queryset.filter(webhook_id__in=options['webhook'])
+        try:
+            since = parse_datetime_param(options, 'since')
+        except ValidationError as exc:
+            raise CommandError(exc.detail['since'])
+        if since:
+            queryset = queryset.filter(created_at__gte=since)
+
+        self.stdout.write(f'Redrove {redrive_dead_letters(queryset)} dead letters')
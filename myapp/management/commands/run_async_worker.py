@@ -0,0 +1,31 @@
+import signal
+
+from django.core.management.base import BaseCommand
+from prometheus_client import start_http_server
+
+from myapp.aio import AsyncDeliveryWorker
+from myapp.metrics import metrics_registry
+
+
+class Command(BaseCommand):
+    help = 'Consumes webhook deliveries and runs them concurrently on an asyncio event loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queue', action='append', help='Queue to consume, repeatable, defaults to every delivery queue'
+        )
+        parser.add_argument('--max-in-flight', type=int, default=None)
+        parser.add_argument('--metrics-port', type=int, default=None, help='Serve Prometheus metrics on this port')
+
+    def handle(self, *args, **options):
+        worker = AsyncDeliveryWorker(queue_names=options['queue'], max_in_flight=options['max_in_flight'])
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: worker.stop())
+
+        if options['metrics_port']:
+            start_http_server(options['metrics_port'], registry=metrics_registry())
+
+        self.stdout.write(
+            f'Consuming {", ".join(worker.queue_names)} with up to {worker.max_in_flight} deliveries in flight'
+        )
+        worker.run()
@@ -0,0 +1,173 @@
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from celery.signals import (
+    before_task_publish, task_postrun, task_prerun, worker_process_shutdown, worker_ready, worker_shutdown,
+)
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.decorators import sync_and_async_middleware
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector, mark_process_dead
+
+from myapp.redis_client import get_redis
+
+ENQUEUED_AT_HEADER = 'enqueued_at'
+
+ROW_BUCKETS = (0, 10, 100, 1000, 10000, 100000, 1000000)
+
+REQUEST_LATENCY = Histogram(
+    'webhook_http_request_duration_seconds', 'HTTP request latency', ['view', 'method', 'status'],
+)
+REQUEST_QUERIES = Histogram(
+    'webhook_http_request_db_queries', 'Database queries run by one HTTP request', ['view'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+TASK_LAG = Histogram('webhook_task_lag_seconds', 'Time from enqueue to task start', ['task'])
+TASK_DURATION = Histogram('webhook_task_duration_seconds', 'Celery task run time', ['task', 'state'])
+DELIVERY_DURATION = Histogram('webhook_delivery_duration_seconds', 'Delivery request time', ['status'])
+DELIVERY_RETRIES = Counter('webhook_delivery_retries', 'Deliveries scheduled for another attempt')
+DEAD_LETTERS = Counter('webhook_dead_letters', 'Deliveries moved to the dead letter table')
+DELIVERIES_PARKED = Counter('webhook_deliveries_parked', 'Deliveries put back while their circuit breaker is open')
+BREAKER_TRANSITIONS = Counter('webhook_breaker_transitions', 'Circuit breaker state changes', ['state'])
+RETENTION_DELETED = Histogram(
+    'webhook_retention_deleted_rows', 'Rows deleted by one retention run', ['kind'], buckets=ROW_BUCKETS,
+)
+
+_request_queries = ContextVar('webhook_request_queries', default=None)
+_task_started = {}
+
+
+class QueueDepthCollector:
+    # Read from Redis at scrape time, so enqueueing pays nothing for it.
+
+    def describe(self):
+        yield GaugeMetricFamily('webhook_queue_depth', 'Messages waiting in a broker queue', labels=['queue'])
+        yield GaugeMetricFamily('webhook_retry_backlog', 'Retries waiting for their delay')
+
+    def collect(self):
+        from myapp.retries import RETRY_QUEUE_KEY
+
+        client = get_redis()
+        depth = GaugeMetricFamily('webhook_queue_depth', 'Messages waiting in a broker queue', labels=['queue'])
+        with client.pipeline(transaction=False) as pipe:
+            for name in settings.WEBHOOK_METRICS_QUEUES:
+                pipe.llen(name)
+            pipe.zcard(RETRY_QUEUE_KEY)
+            *lengths, retries = pipe.execute()
+        for name, length in zip(settings.WEBHOOK_METRICS_QUEUES, lengths):
+            depth.add_metric([name], length)
+        yield depth
+        yield GaugeMetricFamily('webhook_retry_backlog', 'Retries waiting for their delay', value=retries)
+
+
+queue_depth = QueueDepthCollector()
+
+
+def multiprocess():
+    return bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+
+if not multiprocess():
+    REGISTRY.register(queue_depth)
+
+
+def metrics_registry():
+    # Uvicorn and prefork Celery workers each write their samples to PROMETHEUS_MULTIPROC_DIR.
+    if not multiprocess():
+        return REGISTRY
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry)
+    registry.register(queue_depth)
+    return registry
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    # Fired again each time the same wrapper reconnects.
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def _observe_request(request, response, started, counter):
+    match = request.resolver_match
+    view = match.view_name if match else 'unresolved'
+    REQUEST_LATENCY.labels(view, request.method, response.status_code).observe(time.perf_counter() - started)
+    REQUEST_QUERIES.labels(view).observe(counter[0])
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    # The counter is a list so queries run in sync_to_async threads, which copy the context, still add to it.
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            counter = [0]
+            token = _request_queries.set(counter)
+            started = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                _request_queries.reset(token)
+            _observe_request(request, response, started, counter)
+            return response
+    else:
+        def middleware(request):
+            counter = [0]
+            token = _request_queries.set(counter)
+            started = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                _request_queries.reset(token)
+            _observe_request(request, response, started, counter)
+            return response
+    return middleware
+
+
+def observe_lag(task_name, enqueued_at):
+    if enqueued_at:
+        TASK_LAG.labels(task_name).observe(max(time.time() - float(enqueued_at), 0))
+
+
+@before_task_publish.connect
+def stamp_enqueued_at(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault(ENQUEUED_AT_HEADER, time.time())
+
+
+@task_prerun.connect
+def task_started(task_id=None, task=None, **kwargs):
+    observe_lag(task.name, getattr(task.request, ENQUEUED_AT_HEADER, None))
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started)
+
+
+@worker_ready.connect
+def serve_worker_metrics(**kwargs):
+    if settings.CELERY_WORKER_METRICS_PORT:
+        start_http_server(settings.CELERY_WORKER_METRICS_PORT, registry=metrics_registry())
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def mark_worker_dead(**kwargs):
+    # Drops the exited process's live gauge files from PROMETHEUS_MULTIPROC_DIR.
+    if multiprocess():
+        mark_process_dead(os.getpid())
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='webhook',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='webhook_user_created_id_idx'),
+        ),
+    ]
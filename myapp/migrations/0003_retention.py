@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-18 17:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('myapp', '0002_webhook_user_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('retention', models.DurationField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='webhook',
+            name='retention',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='webhook',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='webhook',
+            index=models.Index(condition=models.Q(('retention__isnull', False)), fields=['retention'], name='webhook_retention_idx'),
+        ),
+        migrations.AddField(
+            model_name='retentionpolicy',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='retention_policy', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
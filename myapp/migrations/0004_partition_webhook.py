@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def partition_webhook_table(apps, schema_editor):
+    from myapp.partitions import convert_to_partitioned, is_partitioned
+
+    if schema_editor.connection.vendor == 'postgresql' and settings.WEBHOOK_PARTITIONING and not is_partitioned():
+        convert_to_partitioned()
+
+
+def unpartition_webhook_table(apps, schema_editor):
+    from myapp.partitions import convert_to_regular, is_partitioned
+
+    if is_partitioned():
+        convert_to_regular()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0003_retention'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_webhook_table, unpartition_webhook_table),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 17:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0004_partition_webhook'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhook',
+            name='target_url',
+            field=models.URLField(blank=True, max_length=2048),
+        ),
+    ]
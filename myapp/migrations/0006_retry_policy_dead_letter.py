@@ -0,0 +1,44 @@
+# Generated by Django 4.2 on 2026-10-18 17:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_webhook_target_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetryPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('max_retries', models.PositiveSmallIntegerField()),
+                ('base_delay', models.FloatField()),
+                ('max_delay', models.FloatField()),
+                ('max_age', models.DurationField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DeadLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(max_length=255)),
+                ('data', models.JSONField()),
+                ('error', models.TextField()),
+                ('attempts', models.PositiveSmallIntegerField()),
+                ('first_attempt_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('redriven_at', models.DateTimeField(blank=True, null=True)),
+                ('webhook', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='myapp.webhook')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='webhook',
+            name='retry_policy',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='myapp.retrypolicy'),
+        ),
+    ]
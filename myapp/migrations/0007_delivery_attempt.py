@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 17:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_retry_policy_dead_letter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(db_index=True, max_length=255)),
+                ('attempt', models.PositiveSmallIntegerField()),
+                ('status', models.CharField(choices=[('delivered', 'Delivered'), ('retrying', 'Retrying'), ('dead', 'Dead'), ('skipped', 'Skipped')], max_length=16)),
+                ('response_code', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('latency_ms', models.FloatField(blank=True, null=True)),
+                ('payload_digest', models.CharField(max_length=64)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('webhook', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='myapp.webhook')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='deliveryattempt',
+            index=models.Index(fields=['webhook', 'created_at'], name='attempt_webhook_created_idx'),
+        ),
+    ]
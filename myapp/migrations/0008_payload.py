@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_delivery_attempt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payload',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('body', models.BinaryField()),
+                ('size', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_seen_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
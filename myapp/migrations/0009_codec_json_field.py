@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-18 18:16
+
+from django.db import migrations
+import myapp.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0008_payload'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deadletter',
+            name='data',
+            field=myapp.fields.CodecJSONField(),
+        ),
+        migrations.AlterField(
+            model_name='webhook',
+            name='data',
+            field=myapp.fields.CodecJSONField(),
+        ),
+    ]
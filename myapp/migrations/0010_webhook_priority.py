@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_codec_json_field'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhook',
+            name='priority',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0010_webhook_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryattempt',
+            name='batch_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='webhook',
+            name='batch_window',
+            field=models.DurationField(blank=True, null=True),
+        ),
+    ]
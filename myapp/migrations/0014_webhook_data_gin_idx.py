@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 19:22
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0013_topics'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='webhook',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['data'], name='webhook_data_gin_idx'),
+        ),
+    ]
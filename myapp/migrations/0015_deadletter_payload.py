@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 19:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0014_webhook_data_gin_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deadletter',
+            name='payload',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='dead_letters', to='myapp.payload'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 19:44
+
+from django.db import migrations
+import myapp.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0015_deadletter_payload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deadletter',
+            name='events',
+            field=myapp.fields.CodecJSONField(blank=True, null=True),
+        ),
+    ]
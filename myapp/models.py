@@ -1,11 +1,177 @@
+import random
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 
+from myapp.fields import CodecJSONField
+
+
+class RetryPolicy(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    max_retries = models.PositiveSmallIntegerField()
+    base_delay = models.FloatField()
+    max_delay = models.FloatField()
+    max_age = models.DurationField()
+
+    @classmethod
+    def default(cls):
+        return cls(name='default', **settings.WEBHOOK_RETRY_POLICY)
+
+    def backoff(self, retries):
+        # Full jitter: spreads retries of a failing receiver instead of sending them in waves.
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retries))
+
+    def __str__(self):
+        return self.name
+
 
 class Webhook(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
-    data = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    data = CodecJSONField()
+    target_url = models.URLField(max_length=2048, blank=True)
+    retry_policy = models.ForeignKey(RetryPolicy, null=True, blank=True, on_delete=models.SET_NULL)
+    retention = models.DurationField(null=True, blank=True)
+    priority = models.BooleanField(default=False)
+    batch_window = models.DurationField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='webhook_user_created_id_idx'),
+            models.Index(
+                fields=['retention'], name='webhook_retention_idx', condition=models.Q(retention__isnull=False)
+            ),
+            # Default jsonb_ops rather than the smaller jsonb_path_ops, which cannot answer has_key's ? operator.
+            GinIndex(fields=['data'], name='webhook_data_gin_idx'),
+        ]
 
     def __str__(self):
         return f"Webhook {self.id} by {self.user}"
+
+
+class RetentionPolicy(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='retention_policy')
+    retention = models.DurationField()
+
+    def __str__(self):
+        return f"Retention {self.retention} for {self.user}"
+
+
+class DeadLetter(models.Model):
+    # Every foreign key to Webhook goes without a database constraint, a partitioned table cannot be referenced
+    # by id alone. Django cascades row deletes, run_retention clears the rows of dropped partitions.
+    webhook = models.ForeignKey(Webhook, on_delete=models.CASCADE, db_constraint=False)
+    task_id = models.CharField(max_length=255)
+    data = CodecJSONField()
+    # The stored body the delivery referenced, kept for as long as this row points at it.
+    payload = models.ForeignKey(
+        'Payload', null=True, blank=True, on_delete=models.PROTECT, related_name='dead_letters'
+    )
+    # Task ids of the events a batched delivery carried, a redrive answers for them again.
+    events = CodecJSONField(null=True, blank=True)
+    error = models.TextField()
+    attempts = models.PositiveSmallIntegerField()
+    first_attempt_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    redriven_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Dead letter {self.task_id} for webhook {self.webhook_id}"
+
+
+class DeliveryAttempt(models.Model):
+    DELIVERED = 'delivered'
+    RETRYING = 'retrying'
+    DEAD = 'dead'
+    SKIPPED = 'skipped'
+    STATUS_CHOICES = [
+        (DELIVERED, 'Delivered'),
+        (RETRYING, 'Retrying'),
+        (DEAD, 'Dead'),
+        (SKIPPED, 'Skipped'),
+    ]
+    FINAL_STATUSES = {DELIVERED, DEAD, SKIPPED}
+
+    webhook = models.ForeignKey(Webhook, on_delete=models.CASCADE, db_constraint=False)
+    task_id = models.CharField(max_length=255, db_index=True)
+    attempt = models.PositiveSmallIntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES)
+    response_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    latency_ms = models.FloatField(null=True, blank=True)
+    payload_digest = models.CharField(max_length=64)
+    error = models.TextField(blank=True)
+    batch_id = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['webhook', 'created_at'], name='attempt_webhook_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Attempt {self.attempt} of {self.task_id}: {self.status}"
+
+
+class Payload(models.Model):
+    # Content-addressed delivery bodies, tasks carry the digest instead of the body.
+    digest = models.CharField(max_length=64, primary_key=True)
+    body = models.BinaryField()
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_seen_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Payload {self.digest} ({self.size} bytes)"
+
+
+class CircuitBreaker(models.Model):
+    # Mirror of the breaker state kept in Redis, written on state changes only.
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    STATE_CHOICES = [
+        (CLOSED, 'Closed'),
+        (OPEN, 'Open'),
+        (HALF_OPEN, 'Half open'),
+    ]
+
+    host = models.CharField(max_length=255, unique=True)
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=CLOSED)
+    requests = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    opened_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Circuit breaker for {self.host}: {self.state}"
+
+
+class Topic(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='topic_user_name_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Topic {self.name} by {self.user}"
+
+
+class Subscription(models.Model):
+    # The unique constraint is the index publishing reads subscribers through, so the topic needs no other.
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='subscriptions', db_index=False)
+    webhook = models.ForeignKey(Webhook, on_delete=models.CASCADE, db_constraint=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['topic', 'webhook'], name='subscription_topic_webhook_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Subscription of webhook {self.webhook_id} to {self.topic_id}"
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from myapp.models import Webhook
+from myapp.redis_client import get_async_redis, get_redis
+
+OWNER_KEY = 'webhook:owner:{}'
+EXPIRED_BEFORE_KEY = 'webhook:owner:expired-before'
+TOMBSTONE = b'-'
+
+# Everything the write endpoint needs about a webhook: created_at is a timestamp, batch_window seconds or None.
+Owner = namedtuple('Owner', ['user_id', 'created', 'priority', 'batch_window'])
+
+
+class LocalOwnerCache:
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size or settings.WEBHOOK_OWNER_LOCAL_CACHE_SIZE
+        self.ttl = ttl or settings.WEBHOOK_OWNER_LOCAL_CACHE_TTL
+        self._owners = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, webhook_id):
+        with self._lock:
+            entry = self._owners.get(webhook_id)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._owners[webhook_id]
+                return None
+            self._owners.move_to_end(webhook_id)
+            return entry[0]
+
+    def set(self, webhook_id, owner):
+        with self._lock:
+            self._owners[webhook_id] = (owner, time.monotonic() + self.ttl)
+            self._owners.move_to_end(webhook_id)
+            while len(self._owners) > self.max_size:
+                self._owners.popitem(last=False)
+
+    def discard(self, webhook_ids):
+        with self._lock:
+            for webhook_id in webhook_ids:
+                self._owners.pop(webhook_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._owners.clear()
+
+
+local_owners = None
+
+
+def _local_owners():
+    global local_owners
+
+    if local_owners is None:
+        local_owners = LocalOwnerCache()
+    return local_owners
+
+
+async def aget_owner(webhook_id):
+    # None when the webhook does not exist.
+    owner = _local_owners().get(webhook_id)
+    if owner is not None:
+        return owner
+
+    cached, expired_before = await get_async_redis().mget(OWNER_KEY.format(webhook_id), EXPIRED_BEFORE_KEY)
+    if cached is not None and cached != TOMBSTONE:
+        user_id, created, *flags = cached.decode().split(':')
+        priority, batch_window = (flags + ['', ''])[:2]
+        owner = Owner(int(user_id), float(created), priority == '1', float(batch_window) if batch_window else None)
+        # Dropped partitions are not invalidated key by key, everything older than the cutoff is gone.
+        if expired_before is not None and owner.created < float(expired_before):
+            return None
+    else:
+        row = await Webhook.objects.filter(id=webhook_id).values_list(
+            'user_id', 'created_at', 'priority', 'batch_window'
+        ).afirst()
+        if row is None:
+            return None
+        user_id, created_at, priority, batch_window = row
+        owner = Owner(user_id, created_at.timestamp(), priority, batch_window and batch_window.total_seconds())
+        # NX, so a tombstone left by a delete or change since the read keeps the old owner out of both caches.
+        cached = await get_async_redis().set(
+            OWNER_KEY.format(webhook_id),
+            f'{owner.user_id}:{owner.created}:{int(owner.priority)}:{owner.batch_window or ""}',
+            ex=settings.WEBHOOK_OWNER_CACHE_TTL, nx=True,
+        )
+        if not cached:
+            return owner
+
+    _local_owners().set(webhook_id, owner)
+    return owner
+
+
+async def aowns(webhook_id, user_id):
+    owner = await aget_owner(webhook_id)
+    return owner is not None and owner.user_id == user_id
+
+
+def forget_owners(webhook_ids):
+    webhook_ids = list(webhook_ids)
+    if webhook_ids:
+        _local_owners().discard(webhook_ids)
+        with get_redis().pipeline(transaction=False) as pipe:
+            for webhook_id in webhook_ids:
+                pipe.set(OWNER_KEY.format(webhook_id), TOMBSTONE, ex=settings.WEBHOOK_OWNER_TOMBSTONE_TTL)
+            pipe.execute()
+
+
+def forget_owners_before(cutoff):
+    _local_owners().clear()
+    get_redis().set(EXPIRED_BEFORE_KEY, cutoff.timestamp(), ex=settings.WEBHOOK_OWNER_CACHE_TTL)
+
+
+_batched = threading.local()
+
+
+@contextmanager
+def forgetting_owners():
+    # Webhooks deleted inside are forgotten together on the way out, instead of one round trip per row.
+    if getattr(_batched, 'ids', None) is not None:
+        yield
+        return
+    ids = _batched.ids = set()
+    try:
+        yield
+    finally:
+        _batched.ids = None
+        forget_owners(ids)
+
+
+@receiver(post_save, sender=Webhook)
+def forget_changed_owner(sender, instance, created, **kwargs):
+    # Priority and batching are cached with the owner, so edits must not wait for the TTL.
+    if not created:
+        forget_owners([instance.id])
+
+
+@receiver(post_delete, sender=Webhook)
+def forget_deleted_owner(sender, instance, **kwargs):
+    # Admin, queryset and user cascade deletes all end up here, writes must not outlive the webhook.
+    ids = getattr(_batched, 'ids', None)
+    if ids is not None:
+        ids.add(instance.id)
+    else:
+        forget_owners([instance.id])
@@ -0,0 +1,36 @@
+import codecs
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+from myapp import codec
+
+
+class CodecJSONParser(JSONParser):
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        # JSON bodies are UTF-8 (RFC 8259), the bytes go to the codec without a text decoding pass.
+        try:
+            return codec.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class NDJSONParser(BaseParser):
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        items = []
+        for line_number, line in enumerate(codecs.getreader(encoding)(stream), start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(codec.loads(line))
+            except ValueError as exc:
+                raise ParseError(f'NDJSON parse error on line {line_number} - {exc}')
+        return items
@@ -0,0 +1,188 @@
+import logging
+import re
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from myapp.models import Webhook
+
+logger = logging.getLogger(__name__)
+
+PARTITION_INTERVAL = timedelta(hours=1)
+PARTITION_NAME_FORMAT = '%Y%m%d%H'
+
+
+def _table():
+    return Webhook._meta.db_table
+
+
+def _floor(moment):
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def partition_name(start):
+    return f'{_table()}_p{start:{PARTITION_NAME_FORMAT}}'
+
+
+def partition_start(name):
+    match = re.fullmatch(rf'{re.escape(_table())}_p(\d{{10}})', name)
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1), PARTITION_NAME_FORMAT).replace(tzinfo=dt_timezone.utc)
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass)', [_table()])
+        return cursor.fetchone()[0]
+
+
+def list_partitions():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = %s::regclass',
+            [_table()],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    return sorted((start, name) for name in names if (start := partition_start(name)) is not None)
+
+
+def create_partitions(start, end):
+    quote = connection.ops.quote_name
+    created = []
+    moment = _floor(start)
+    while moment < end:
+        name = partition_name(moment)
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS {quote(name)} PARTITION OF {quote(_table())} '
+                    f'FOR VALUES FROM (%s) TO (%s)',
+                    [moment, moment + PARTITION_INTERVAL],
+                )
+            created.append(name)
+        except DatabaseError:
+            # The default partition already holds rows for this hour, they stay there
+            # and are expired by the chunked retention pass.
+            logger.exception('Could not create partition %s', name)
+        moment += PARTITION_INTERVAL
+    return created
+
+
+def ensure_partitions(ahead=None, now=None):
+    ahead = settings.WEBHOOK_PARTITIONS_AHEAD if ahead is None else ahead
+    now = now or timezone.now()
+    return create_partitions(now, now + ahead * PARTITION_INTERVAL)
+
+
+def drop_expired_partitions(before, keep=None, detached=None, deadline=None):
+    # `keep(start, end)` spares an hour that still holds live rows, `detached(name)` runs between detach and drop.
+    # Past the monotonic `deadline` no further hour is dropped, the next call picks up the rest.
+    quote = connection.ops.quote_name
+    dropped = []
+    for start, name in list_partitions():
+        if start + PARTITION_INTERVAL > before:
+            break
+        if deadline is not None and dropped and time.monotonic() >= deadline:
+            break
+        if keep is not None and keep(start, start + PARTITION_INTERVAL):
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {quote(_table())} DETACH PARTITION {quote(name)}')
+            if detached is not None:
+                # A failure rolls the detach back, the hour is retried on the next run.
+                detached(name)
+            cursor.execute(f'DROP TABLE {quote(name)}')
+        dropped.append(name)
+    return dropped
+
+
+def _index_definitions(cursor, table):
+    cursor.execute(
+        'SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN ('
+        'SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)',
+        [table, table],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _recreate_indexes(cursor, definitions, old_table, table):
+    for definition in definitions:
+        cursor.execute(re.sub(rf'\bON (ONLY )?(\w+\.)?{old_table}\b', f'ON {table}', definition))
+
+
+def _add_user_foreign_key(cursor, table):
+    user_table = Webhook._meta.get_field('user').related_model._meta.db_table
+    cursor.execute(
+        f'ALTER TABLE {table} ADD CONSTRAINT {table}_user_id_fk FOREIGN KEY (user_id) '
+        f'REFERENCES {user_table} (id) DEFERRABLE INITIALLY DEFERRED'
+    )
+
+
+@transaction.atomic
+def convert_to_partitioned(now=None):
+    table = _table()
+    old_table = f'{table}_unpartitioned'
+    sequence = f'{table}_id_seq'
+    now = now or timezone.now()
+
+    with connection.cursor() as cursor:
+        # Deferred foreign key checks queued earlier in this transaction would block the rename.
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f"SELECT pg_sequence_last_value(pg_get_serial_sequence('{table}', 'id'))")
+        last_id = cursor.fetchone()[0]
+        cursor.execute(f'SELECT min(created_at) FROM {table}')
+        oldest = cursor.fetchone()[0] or now
+
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {old_table}')
+        cursor.execute(f'ALTER TABLE {old_table} ALTER COLUMN id DROP IDENTITY IF EXISTS')
+        cursor.execute(f'ALTER TABLE {old_table} ALTER COLUMN id DROP DEFAULT')
+        indexes = _index_definitions(cursor, old_table)
+
+        cursor.execute(
+            f'CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE (created_at)'
+        )
+        cursor.execute(f'DROP SEQUENCE IF EXISTS {sequence}')
+        cursor.execute(f'CREATE SEQUENCE {sequence} OWNED BY {table}.id')
+        if last_id:
+            cursor.execute('SELECT setval(%s, %s)', [sequence, last_id])
+        cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+        cursor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+
+    create_partitions(oldest, now + settings.WEBHOOK_PARTITIONS_AHEAD * PARTITION_INTERVAL)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {table} SELECT * FROM {old_table}')
+        cursor.execute(f'DROP TABLE {old_table}')
+        # Partitioned tables need the partition key in the primary key, so id alone is no longer unique.
+        cursor.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)')
+        _add_user_foreign_key(cursor, table)
+        _recreate_indexes(cursor, indexes, old_table, table)
+
+
+@transaction.atomic
+def convert_to_regular():
+    table = _table()
+    old_table = f'{table}_partitioned'
+    sequence = f'{table}_id_seq'
+
+    with connection.cursor() as cursor:
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {old_table}')
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY NONE')
+        indexes = _index_definitions(cursor, old_table)
+        cursor.execute(f'CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(f'INSERT INTO {table} SELECT * FROM {old_table}')
+        cursor.execute(f'DROP TABLE {old_table} CASCADE')
+        cursor.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id)')
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+        _add_user_foreign_key(cursor, table)
+        _recreate_indexes(cursor, indexes, old_table, table)
@@ -0,0 +1,40 @@
+import hashlib
+
+from django.utils import timezone
+
+from myapp import codec
+from myapp.models import Payload
+
+
+def _payload(body):
+    return Payload(digest=hashlib.sha256(body).hexdigest(), body=body, size=len(body), last_seen_at=timezone.now())
+
+
+def build_payload(data):
+    # Sorted keys, so the same event encoded in a different key order gets the same digest.
+    return _payload(codec.canonical_dumps(data))
+
+
+def build_batch_payload(bodies):
+    # A JSON array of bodies that are canonical already, so one digest covers the whole batch.
+    return _payload(b'[' + b','.join(bodies) + b']')
+
+
+async def astore_payload(payload):
+    # Identical bodies share one row, a repeat only moves last_seen_at so retention keeps it.
+    await Payload.objects.abulk_create(
+        [payload], update_conflicts=True, unique_fields=['digest'], update_fields=['last_seen_at']
+    )
+    return payload.digest
+
+
+def store_payload(payload):
+    Payload.objects.bulk_create(
+        [payload], update_conflicts=True, unique_fields=['digest'], update_fields=['last_seen_at']
+    )
+    return payload.digest
+
+
+def load_payload(digest):
+    body = Payload.objects.filter(digest=digest).values_list('body', flat=True).first()
+    return None if body is None else bytes(body)
@@ -0,0 +1,27 @@
+import asyncio
+import weakref
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+_client = None
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis():
+    global _client
+
+    # redis-py pools detect forks and reconnect, so one client per process is enough.
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
+
+
+def get_async_redis():
+    # asyncio connections belong to the loop that opened them.
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+    return client
@@ -0,0 +1,17 @@
+from rest_framework.renderers import JSONRenderer
+
+from myapp import codec
+
+
+class CodecJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # Indented output is only asked for by people reading it, the standard encoder handles that.
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            return codec.dumps(data)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
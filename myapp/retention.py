@@ -0,0 +1,220 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import DateTimeField, ExpressionWrapper, F, Max, Min, ProtectedError, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from myapp import codec
+from myapp.archive import archive_enabled, archive_table, archive_webhooks
+from myapp.batching import batched_payloads
+from myapp.metrics import ENQUEUED_AT_HEADER, RETENTION_DELETED
+from myapp.models import DeadLetter, DeliveryAttempt, Payload, RetentionPolicy, RetryPolicy, Subscription, Webhook
+from myapp.ownership import forget_owners, forget_owners_before, forgetting_owners
+from myapp.partitions import PARTITION_INTERVAL, drop_expired_partitions, is_partitioned, partition_start
+from myapp.redis_client import get_redis
+from myapp.retries import scheduled_payloads
+from myapp.routing import delivery_queues
+
+logger = logging.getLogger(__name__)
+
+HIGH_WATER_MARK_KEY = 'retention:webhook:high-water-mark'
+LOCK_KEY = 'retention:webhook:lock'
+
+
+def _retention_candidates(aggregate):
+    return [
+        settings.WEBHOOK_RETENTION,
+        RetentionPolicy.objects.aggregate(value=aggregate('retention'))['value'],
+        Webhook.objects.filter(retention__isnull=False).aggregate(value=aggregate('retention'))['value'],
+    ]
+
+
+def shortest_retention():
+    return min(candidate for candidate in _retention_candidates(Min) if candidate is not None)
+
+
+def longest_retention():
+    return max(candidate for candidate in _retention_candidates(Max) if candidate is not None)
+
+
+def longest_retry_age():
+    longest = RetryPolicy.objects.aggregate(value=Max('max_age'))['value']
+    default = settings.WEBHOOK_RETRY_POLICY['max_age']
+    return max(longest, default) if longest is not None else default
+
+
+def backlog_age(now):
+    # How long the oldest message still waiting in a delivery or flush queue has been there.
+    # Kombu pushes messages on the left and takes them from the right.
+    with get_redis().pipeline(transaction=False) as pipe:
+        for name in [*delivery_queues(), settings.WEBHOOK_BATCH_FLUSH_QUEUE]:
+            pipe.lindex(name, -1)
+        oldest = [codec.loads(message)['headers'].get(ENQUEUED_AT_HEADER) for message in pipe.execute() if message]
+    enqueued_at = [float(value) for value in oldest if value]
+    if not enqueued_at:
+        return timedelta(0)
+    return timedelta(seconds=max(now.timestamp() - min(enqueued_at), 0))
+
+
+def expired_payloads(now):
+    # A task references its payload until its last retry, whose age only starts counting once its message
+    # has left the queue. Dead letters reference it for as long as they exist.
+    cutoff = now - longest_retry_age() - backlog_age(now)
+    return Payload.objects.filter(last_seen_at__lt=cutoff, dead_letters__isnull=True)
+
+
+def referenced_payloads():
+    # Retries and open batches can hold on to a payload past the cutoff, whatever its age.
+    return scheduled_payloads() | batched_payloads()
+
+
+def _with_expiry():
+    # A webhook's own retention wins over its owner's policy, which wins over the global default.
+    retention = Coalesce('retention', 'user__retention_policy__retention', Value(settings.WEBHOOK_RETENTION))
+    return Webhook.objects.alias(
+        expires_at=ExpressionWrapper(F('created_at') + retention, output_field=DateTimeField())
+    )
+
+
+def expired_webhooks(now):
+    return _with_expiry().filter(created_at__lt=now - shortest_retention(), expires_at__lte=now)
+
+
+def _forget_partition_owners(name, chunk_size):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT id FROM {connection.ops.quote_name(name)}')
+        while rows := cursor.fetchmany(chunk_size):
+            forget_owners(row[0] for row in rows)
+
+
+def _delete_dependents(name):
+    # Nothing cascades from a dropped table, rows pointing at its webhooks go in the same transaction.
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for model in (DeliveryAttempt, DeadLetter, Subscription):
+            cursor.execute(
+                f'DELETE FROM {quote(model._meta.db_table)} WHERE webhook_id IN (SELECT id FROM {quote(name)})'
+            )
+
+
+def drop_partitions(now, archive, chunk_size, deadline=None):
+    # Hours past the longest retention are dropped unseen. A younger hour is dropped once none of its rows
+    # is still live, so one long retention only keeps its own hour.
+    unseen_before = now - longest_retention()
+    live = _with_expiry().filter(expires_at__gt=now)
+    kept_any = False
+    owners_cutoff = None
+
+    def keep(start, end):
+        nonlocal kept_any
+        kept = end > unseen_before and live.filter(created_at__gte=start, created_at__lt=end).exists()
+        kept_any = kept_any or kept
+        return kept
+
+    def detached(name):
+        nonlocal owners_cutoff
+        if archive:
+            archive_table(name)
+        _delete_dependents(name)
+        if kept_any:
+            # A live hour comes before this one, so the owner cutoff cannot move past it.
+            _forget_partition_owners(name, chunk_size)
+        else:
+            owners_cutoff = partition_start(name) + PARTITION_INTERVAL
+
+    dropped = drop_expired_partitions(now - shortest_retention(), keep, detached, deadline)
+    if owners_cutoff is not None:
+        forget_owners_before(owners_cutoff)
+    return len(dropped)
+
+
+def collect_payloads(now, chunk_size, deadline):
+    deleted = 0
+    payloads = expired_payloads(now).order_by('digest')
+    referenced = referenced_payloads()
+    last_digest = ''
+    while time.monotonic() < deadline:
+        digests = list(payloads.filter(digest__gt=last_digest).values_list('digest', flat=True)[:chunk_size])
+        if not digests:
+            break
+        last_digest = digests[-1]
+        digests = [digest for digest in digests if digest not in referenced]
+        if not digests:
+            continue
+        try:
+            Payload.objects.filter(digest__in=digests).delete()
+        except ProtectedError:
+            # A delivery was dead-lettered since the chunk was picked, the next run takes the rest of it.
+            continue
+        deleted += len(digests)
+    return deleted
+
+
+def run_retention(now=None, chunk_size=None, time_budget=None):
+    now = now or timezone.now()
+    chunk_size = chunk_size or settings.WEBHOOK_RETENTION_CHUNK_SIZE
+    time_budget = time_budget or settings.WEBHOOK_RETENTION_TIME_BUDGET
+
+    if not cache.add(LOCK_KEY, 1, timeout=time_budget * 2):
+        logger.info('Retention run skipped, another run is in progress')
+        return None
+
+    try:
+        started = time.monotonic()
+        deadline = started + time_budget
+        archive = archive_enabled()
+        partitions_dropped = drop_partitions(now, archive, chunk_size, deadline) if is_partitioned() else 0
+
+        # Each phase may overrun the budget by one chunk or partition, the lock is extended so it outlives them.
+        cache.touch(LOCK_KEY, time_budget * 2)
+        high_water_mark = cache.get(HIGH_WATER_MARK_KEY, 0)
+        candidates = expired_webhooks(now)
+        deleted = chunks = 0
+
+        while True:
+            ids = list(candidates.filter(id__gt=high_water_mark).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                # The pass reached the end of the table, the next run starts over to pick up
+                # rows that were skipped because they had a longer retention.
+                high_water_mark = 0
+                break
+
+            if archive:
+                # Written before the delete, a crash in between archives the chunk twice rather than never.
+                archive_webhooks(ids)
+            with forgetting_owners():
+                Webhook.objects.filter(id__in=ids).delete()
+            deleted += len(ids)
+            chunks += 1
+            high_water_mark = ids[-1]
+            if time.monotonic() >= deadline:
+                break
+
+        cache.set(HIGH_WATER_MARK_KEY, high_water_mark, timeout=None)
+
+        payloads_deleted = 0
+        if time.monotonic() < deadline:
+            cache.touch(LOCK_KEY, time_budget * 2)
+            payloads_deleted = collect_payloads(now, chunk_size, deadline)
+    finally:
+        cache.delete(LOCK_KEY)
+
+    seconds = time.monotonic() - started
+    stats = {
+        'deleted': deleted,
+        'chunks': chunks,
+        'partitions_dropped': partitions_dropped,
+        'payloads_deleted': payloads_deleted,
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(deleted / seconds, 1) if seconds else 0.0,
+        'high_water_mark': high_water_mark,
+    }
+    RETENTION_DELETED.labels('webhooks').observe(deleted)
+    RETENTION_DELETED.labels('payloads').observe(payloads_deleted)
+    logger.info('Retention run finished: %s', stats)
+    return stats
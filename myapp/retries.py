@@ -0,0 +1,158 @@
+import random
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from celery import current_app
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from myapp import codec
+from myapp.delivery import record_attempt
+from myapp.metrics import DEAD_LETTERS, DELIVERIES_PARKED, DELIVERY_RETRIES
+from myapp.models import DeadLetter, DeliveryAttempt, Webhook
+from myapp.redis_client import get_redis
+from myapp.routing import delivery_queue
+
+RETRY_QUEUE_KEY = 'webhook:retries'
+
+# Pops due entries in one step so concurrent dispatchers never publish the same retry twice.
+POP_DUE_SCRIPT = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #items > 0 then
+    redis.call('ZREM', KEYS[1], unpack(items))
+end
+return items
+"""
+
+
+def schedule_retry(task_id, args, kwargs, retries, delay, queue=None):
+    entry = codec.dumps({'task_id': task_id, 'args': args, 'kwargs': kwargs, 'retries': retries, 'queue': queue})
+    get_redis().zadd(RETRY_QUEUE_KEY, {entry: time.time() + delay})
+
+
+def pending_retries():
+    return get_redis().zcard(RETRY_QUEUE_KEY)
+
+
+def scheduled_payloads():
+    # Digests still referenced by retries waiting for their delay.
+    digests = set()
+    for entry, _ in get_redis().zscan_iter(RETRY_QUEUE_KEY, count=1000):
+        payload = codec.loads(entry)['kwargs'].get('payload')
+        if payload is not None:
+            digests.add(payload)
+    return digests
+
+
+def dispatch_due_retries(now=None, limit=None):
+    now = now or time.time()
+    limit = limit or settings.WEBHOOK_RETRY_DISPATCH_BATCH
+    task = current_app.tasks['myapp.tasks.send_data_task']
+
+    client = get_redis()
+    entries = client.eval(POP_DUE_SCRIPT, 1, RETRY_QUEUE_KEY, now, limit)
+    for i, raw in enumerate(entries):
+        entry = codec.loads(raw)
+        try:
+            task.apply_async(entry['args'], entry['kwargs'], task_id=entry['task_id'], retries=entry['retries'],
+                             queue=entry.get('queue'))
+        except Exception:
+            # Whatever was not published goes back as still due, for the next dispatch to pick up.
+            client.zadd(RETRY_QUEUE_KEY, dict.fromkeys(entries[i:], time.time()))
+            raise
+    return len(entries)
+
+
+def handle_delivery_failure(delivery, task_id, retries, first_attempt_at, error, latency=None):
+    policy = delivery.retry_policy
+    delay = policy.backoff(retries)
+    age = time.time() + delay - first_attempt_at
+    exhausted = error.permanent or retries >= policy.max_retries or age > policy.max_age.total_seconds()
+
+    record_attempt(
+        delivery, task_id, retries + 1, DeliveryAttempt.DEAD if exhausted else DeliveryAttempt.RETRYING,
+        latency=latency, response_code=error.status, error=str(error),
+    )
+    if exhausted:
+        reason = 'Rejected by receiver' if error.permanent else 'Max retries exceeded'
+        return _dead_letter(delivery, task_id, retries + 1, first_attempt_at, str(error), reason)
+
+    DELIVERY_RETRIES.inc()
+    _schedule_delivery(delivery, task_id, retries + 1, first_attempt_at, delay)
+    return None
+
+
+def park_delivery(delivery, task_id, retries, first_attempt_at, wait):
+    # Comes back when its breaker takes probes again, without using up one of its retries.
+    # The jitter spreads out the wake-up of everything parked behind the same breaker.
+    delay = wait + random.uniform(0, wait)
+    if time.time() + delay - first_attempt_at > delivery.retry_policy.max_age.total_seconds():
+        # A breaker that stays open cannot keep a delivery around past its max age.
+        error = f'Circuit breaker for {delivery.host} is open'
+        record_attempt(delivery, task_id, retries + 1, DeliveryAttempt.DEAD, error=error)
+        return _dead_letter(delivery, task_id, retries + 1, first_attempt_at, error, 'Max age exceeded')
+
+    DELIVERIES_PARKED.inc()
+    _schedule_delivery(delivery, task_id, retries, first_attempt_at, delay)
+    return None
+
+
+def _dead_letter(delivery, task_id, attempts, first_attempt_at, error, reason):
+    dead_letter = DeadLetter.objects.create(
+        webhook_id=delivery.webhook_id,
+        task_id=task_id,
+        data=delivery.data,
+        payload_id=delivery.payload,
+        events=delivery.events,
+        error=error,
+        attempts=attempts,
+        first_attempt_at=datetime.fromtimestamp(first_attempt_at, dt_timezone.utc),
+    )
+    DEAD_LETTERS.inc()
+    return {'error': reason, 'dead_letter_id': dead_letter.id}
+
+
+def _schedule_delivery(delivery, task_id, retries, first_attempt_at, delay):
+    kwargs = {'webhook_id': delivery.webhook_id, 'first_attempt_at': first_attempt_at}
+    if delivery.events is not None:
+        kwargs['events'] = delivery.events
+    if delivery.payload is not None:
+        # Retries keep referencing the stored payload instead of carrying the body.
+        schedule_retry(task_id, [], {**kwargs, 'payload': delivery.payload}, retries, delay, delivery.queue)
+    else:
+        schedule_retry(task_id, [delivery.data], kwargs, retries, delay, delivery.queue)
+
+
+def redrive_dead_letters(queryset):
+    task = current_app.tasks['myapp.tasks.send_data_task']
+    model = queryset.model
+    # Claimed before anything is published, so concurrent redrives never publish the same dead letter twice.
+    with transaction.atomic():
+        dead_letters = list(
+            model.objects.filter(id__in=queryset.values('id'), redriven_at__isnull=True)
+            .select_for_update(skip_locked=True).order_by('id')
+        )
+        model.objects.filter(id__in=[dead_letter.id for dead_letter in dead_letters]).update(
+            redriven_at=timezone.now()
+        )
+
+    routes = Webhook.objects.filter(id__in={dead_letter.webhook_id for dead_letter in dead_letters})
+    queues = {webhook_id: delivery_queue(user_id, priority)
+              for webhook_id, user_id, priority in routes.values_list('id', 'user_id', 'priority')}
+    for i, dead_letter in enumerate(dead_letters):
+        if dead_letter.payload_id is not None:
+            args, kwargs = (), {'webhook_id': dead_letter.webhook_id, 'payload': dead_letter.payload_id}
+        else:
+            args, kwargs = (dead_letter.data,), {'webhook_id': dead_letter.webhook_id}
+        if dead_letter.events is not None:
+            kwargs['events'] = dead_letter.events
+        try:
+            task.apply_async(args, kwargs, task_id=dead_letter.task_id, queue=queues.get(dead_letter.webhook_id))
+        except Exception:
+            # Whatever was not published is released, for a later redrive to pick up.
+            model.objects.filter(id__in=[dead_letter.id for dead_letter in dead_letters[i:]]).update(
+                redriven_at=None
+            )
+            raise
+    return len(dead_letters)
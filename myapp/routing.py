@@ -0,0 +1,49 @@
+from django.conf import settings
+
+
+def delivery_queue(user_id, priority=False):
+    # A tenant always lands on the same shard, so a burst from one user queues behind itself only.
+    if priority:
+        return settings.WEBHOOK_PRIORITY_QUEUE
+    if not settings.WEBHOOK_DELIVERY_SHARDS:
+        return settings.WEBHOOK_DELIVERY_QUEUE
+    return f'{settings.WEBHOOK_DELIVERY_QUEUE}.{user_id % settings.WEBHOOK_DELIVERY_SHARDS}'
+
+
+def delivery_queues():
+    shards = [delivery_queue(shard) for shard in range(settings.WEBHOOK_DELIVERY_SHARDS)]
+    return [settings.WEBHOOK_PRIORITY_QUEUE, settings.WEBHOOK_DELIVERY_QUEUE, *shards]
+
+
+def delivery_quanta(queue_names):
+    return {
+        name: settings.WEBHOOK_PRIORITY_QUANTUM if name == settings.WEBHOOK_PRIORITY_QUEUE else 1
+        for name in queue_names
+    }
+
+
+class DeficitRoundRobin:
+    # Each visit to a queue with waiting messages adds its quantum to its deficit, one message costs one.
+    # Queues going empty lose their deficit, so an idle tenant cannot save up for a later burst.
+
+    def __init__(self, quanta):
+        self.quanta = quanta
+        self.deficits = dict.fromkeys(quanta, 0)
+        self._order = list(quanta)
+        self._current = 0
+        self.deficits[self._order[0]] = quanta[self._order[0]]
+
+    def pick(self, waiting):
+        # Takes the queue of the next message out of `waiting`, a count of messages per queue.
+        if not any(waiting.get(name) for name in self._order):
+            return None
+        while True:
+            name = self._order[self._current]
+            if waiting.get(name) and self.deficits[name] >= 1:
+                self.deficits[name] -= 1
+                waiting[name] -= 1
+                return name
+            if not waiting.get(name):
+                self.deficits[name] = 0
+            self._current = (self._current + 1) % len(self._order)
+            self.deficits[self._order[self._current]] += self.quanta[self._order[self._current]]
@@ -1,10 +1,43 @@
+from datetime import timedelta
+
+from django.conf import settings
 from rest_framework import serializers
-from .models import Webhook
+from .models import DeliveryAttempt, Webhook
 
 
 class WebhookSerializer(serializers.ModelSerializer):
     class Meta:
         model = Webhook
-        fields = ['id', 'data', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'data', 'target_url', 'created_at', 'retention', 'priority', 'batch_window']
+        # The priority lane is granted by an operator in the admin, never by the tenant itself.
+        read_only_fields = ['id', 'created_at', 'priority']
+
+    def validate_retention(self, value):
+        if value is not None and not timedelta(0) < value <= settings.WEBHOOK_MAX_RETENTION:
+            raise serializers.ValidationError(
+                f'Retention must be positive and at most {settings.WEBHOOK_MAX_RETENTION}.'
+            )
+        return value
+
+    def validate_batch_window(self, value):
+        if value is not None and not timedelta(0) < value <= settings.WEBHOOK_MAX_BATCH_WINDOW:
+            raise serializers.ValidationError(
+                f'Batch window must be positive and at most {settings.WEBHOOK_MAX_BATCH_WINDOW}.'
+            )
+        return value
+
+
+class DeliveryAttemptSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeliveryAttempt
+        fields = ['task_id', 'attempt', 'status', 'response_code', 'latency_ms', 'payload_digest', 'error',
+                  'batch_id', 'created_at']
+
+
+class TaskBatchSerializer(serializers.Serializer):
+    task_ids = serializers.ListField(child=serializers.CharField(max_length=255), allow_empty=False)
 
+    def validate_task_ids(self, value):
+        if len(value) > settings.WEBHOOK_TASK_BATCH_MAX:
+            raise serializers.ValidationError(f'At most {settings.WEBHOOK_TASK_BATCH_MAX} task ids per request.')
+        return value
@@ -1,37 +1,67 @@
-import json
-from datetime import timedelta
-
-from celery import shared_task
 import time
-import random
-import hashlib
 
-from celery.exceptions import MaxRetriesExceededError
-from django.utils import timezone
+from celery import shared_task
+from celery.exceptions import Ignore
 
-from myapp.models import Webhook
+from myapp import batching, breaker, retries
+from myapp.delivery import DeliveryError, deliver, prepare_delivery, record_attempt
+from myapp.models import DeliveryAttempt
+from myapp.partitions import ensure_partitions, is_partitioned
+from myapp.retention import run_retention
+from myapp.retries import handle_delivery_failure, park_delivery
 
 
 @shared_task(bind=True)
-def send_data_task(self, data):
+def send_data_task(self, data=None, webhook_id=None, first_attempt_at=None, payload=None, events=None):
+    first_attempt_at = first_attempt_at or time.time()
+    delivery = prepare_delivery(data, webhook_id, payload, events)
+    if delivery.skip_reason:
+        record_attempt(delivery, self.request.id, self.request.retries + 1, DeliveryAttempt.SKIPPED,
+                       error=delivery.skip_reason)
+        return {'error': delivery.skip_reason, 'md5': delivery.md5}
+
+    wait = breaker.allow(delivery.host)
+    if wait:
+        result = park_delivery(delivery, self.request.id, self.request.retries, first_attempt_at, wait)
+        if result is not None:
+            return result
+        raise Ignore()
+
+    started = time.perf_counter()
     try:
-        time.sleep(5)
-        result = random.randint(0, 50)
-        if result <= 10:
-            raise ValueError('Ошибка')
+        status = deliver(delivery.target_url, delivery.body, headers=delivery.headers)
+    except DeliveryError as exc:
+        result = handle_delivery_failure(
+            delivery, self.request.id, self.request.retries, first_attempt_at, exc,
+            latency=time.perf_counter() - started,
+        )
+        if result is not None:
+            return result
+        # The retry waits in the scheduler, not in this worker, and reuses this task id.
+        self.backend.mark_as_retry(self.request.id, exc, request=self.request)
+        raise Ignore()
+
+    record_attempt(delivery, self.request.id, self.request.retries + 1, DeliveryAttempt.DELIVERED,
+                   latency=time.perf_counter() - started, response_code=status)
+    return delivery.result(status)
 
-        data_str = json.dumps(data).encode('utf-8')
-        md5_result = hashlib.md5(data_str).hexdigest()
 
-        return {'number': result, 'md5': md5_result}
-    except ValueError:
-        try:
-            self.retry(countdown=5, max_retries=5)
-        except MaxRetriesExceededError:
-            return {"error": "Максимальное количество попыток превышено"}
+@shared_task
+def flush_webhook_batch(webhook_id):
+    return batching.flush_batch(webhook_id)
 
 
 @shared_task
 def delete_old_webhooks():
-    time_threshold = timezone.now() - timedelta(hours=4)
-    Webhook.objects.filter(created_at__lt=time_threshold).delete()
+    return run_retention()
+
+
+@shared_task
+def create_webhook_partitions():
+    if is_partitioned():
+        return ensure_partitions()
+
+
+@shared_task
+def dispatch_due_retries():
+    return retries.dispatch_due_retries()
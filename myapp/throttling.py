@@ -0,0 +1,129 @@
+import threading
+import time
+
+from django.conf import settings
+
+from myapp.redis_client import get_async_redis
+
+USER_BUCKET_KEY = 'webhook:bucket:user:{}'
+WEBHOOK_BUCKET_KEY = 'webhook:bucket:webhook:{}'
+
+# Refills every bucket to now, then takes `cost` tokens from all of them or from none. A cost above a bucket's
+# burst takes the whole burst, so a large fan-out drains the bucket instead of never fitting in it.
+# Returns each bucket's seconds until it has enough tokens, as strings because Lua numbers become integers.
+TAKE_TOKEN_SCRIPT = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local tokens = {}
+local costs = {}
+local waits = {}
+local empty = false
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local burst = tonumber(ARGV[i * 2 + 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated_at')
+    local available = tonumber(bucket[1]) or burst
+    local updated_at = tonumber(bucket[2]) or now
+    available = math.min(burst, available + math.max(0, now - updated_at) * rate)
+    costs[i] = math.min(cost, burst)
+    waits[i] = '0'
+    if available < costs[i] then
+        waits[i] = tostring((costs[i] - available) / rate)
+        empty = true
+    end
+    tokens[i] = available
+end
+if empty then
+    return waits
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local burst = tonumber(ARGV[i * 2 + 2])
+    redis.call('HSET', key, 'tokens', tokens[i] - costs[i], 'updated_at', now)
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return waits
+"""
+
+
+class LocalBlocklist:
+    # Callers already known to be out of tokens are refused here until their wait is over,
+    # so a client hammering the endpoint costs no Redis round trips.
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or settings.WEBHOOK_THROTTLE_LOCAL_SIZE
+        self._blocked = {}
+        self._lock = threading.Lock()
+
+    def wait(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            return max((self._blocked.get(key, now) - now for key in keys), default=0)
+
+    def block(self, key, wait):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._blocked) >= self.max_size:
+                self._blocked = {blocked: until for blocked, until in self._blocked.items() if until > now}
+            self._blocked[key] = now + wait
+
+    def clear(self):
+        with self._lock:
+            self._blocked.clear()
+
+
+local_blocklist = None
+
+
+def _local_blocklist():
+    global local_blocklist
+
+    if local_blocklist is None:
+        local_blocklist = LocalBlocklist()
+    return local_blocklist
+
+
+def _buckets(user_id, webhook_id):
+    buckets = []
+    if settings.WEBHOOK_USER_WRITE_RATE:
+        buckets.append((USER_BUCKET_KEY.format(user_id), settings.WEBHOOK_USER_WRITE_RATE,
+                        settings.WEBHOOK_USER_WRITE_BURST))
+    if settings.WEBHOOK_WRITE_RATE and webhook_id is not None:
+        buckets.append((WEBHOOK_BUCKET_KEY.format(webhook_id), settings.WEBHOOK_WRITE_RATE,
+                        settings.WEBHOOK_WRITE_BURST))
+    return buckets
+
+
+async def athrottle(user_id, webhook_id=None, cost=1):
+    # Returns 0 when the write may go ahead, otherwise the seconds to wait before retrying.
+    buckets = _buckets(user_id, webhook_id)
+    if not buckets:
+        return 0
+    keys = [key for key, _, _ in buckets]
+    blocklist = _local_blocklist()
+    wait = blocklist.wait(keys)
+    if wait > 0:
+        return wait
+
+    args = [time.time(), cost]
+    for _, rate, burst in buckets:
+        args.extend((rate, burst))
+    waits = [float(wait) for wait in await get_async_redis().eval(TAKE_TOKEN_SCRIPT, len(keys), *keys, *args)]
+    for key, wait in zip(keys, waits):
+        # A refused fan-out only says when its own cost fits, a single write may fit sooner.
+        if wait > 0 and cost == 1:
+            blocklist.block(key, wait)
+    return max(waits)
+
+
+_queue_depth = {}
+
+
+async def aadmit(queue_name):
+    # The depth is sampled at most once per interval per process, so admission adds no round trip to most writes.
+    checked_at, depth = _queue_depth.get(queue_name, (None, 0))
+    now = time.monotonic()
+    if checked_at is None or now - checked_at >= settings.WEBHOOK_ADMISSION_CHECK_INTERVAL:
+        depth = await get_async_redis().llen(queue_name)
+        _queue_depth[queue_name] = (now, depth)
+    return depth < settings.WEBHOOK_ADMISSION_QUEUE_DEPTH
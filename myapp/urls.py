@@ -1,12 +1,19 @@
 from myapp.views import TaskResultView, WebhookWriteView, WebhookCreateView, WebhookViewSet, \
-    WebhookDetailView
+    WebhookDetailView, WebhookBulkCreateView, TaskBatchResultView, WebhookExportView, TopicPublishView, \
+    WebhookArchiveView
 from django.urls import path
 
 urlpatterns = [
     path('webhook/', WebhookCreateView.as_view(), name='create-webhook'),
+    path('webhook/bulk/', WebhookBulkCreateView.as_view(), name='bulk-create-webhook'),
     path('webhook/<int:webhook_id>/write/', WebhookWriteView.as_view(), name='write-webhook'),
     path('webhook/list/', WebhookViewSet.as_view(), name="webhook-list"),
+    path('webhook/export/<str:export_format>/', WebhookExportView.as_view(), name='webhook-export'),
+    path('webhook/archive/', WebhookArchiveView.as_view(), name='webhook-archive'),
     path('webhook/<int:pk>/', WebhookDetailView.as_view(), name="webhook-detail"),
 
+    path('topic/<int:topic_id>/publish/', TopicPublishView.as_view(), name='publish-topic'),
+
+    path('task/batch/', TaskBatchResultView.as_view(), name='task-batch-result'),
     path('task/<str:task_id>/', TaskResultView.as_view(), name='task-result'),
 ]
@@ -1,47 +1,243 @@
+import asyncio
+import uuid
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import login
-from django.contrib.auth.models import User
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.views import View
-from keycloak import KeycloakOpenID
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from rest_framework import status
+from rest_framework.exceptions import Throttled
 from rest_framework.generics import ListAPIView, RetrieveDestroyAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Webhook
+from . import codec
+from .aio import enqueue_task, enqueue_tasks
+from .archive import archive_enabled, aread_archive
+from .batching import aappend
+from .export import CONTENT_TYPES, aiter_export
+from .filters import filter_created_range, filter_data, parse_datetime_param
+from .idempotency import MAX_KEY_LENGTH, aclaim, arelease, write_key
+from .identity import get_keycloak_openid, sync_user
+from .ingest import bulk_create_webhooks
+from .metrics import metrics_registry
+from .models import DeliveryAttempt, Subscription, Topic, Webhook
+from .ownership import aget_owner
+from .pagination import WebhookCursorPagination
+from .parsers import CodecJSONParser, NDJSONParser
+from .payloads import astore_payload, build_payload
 from .permission import PermIsAuthenticated
-from .schemas import UserInfo
-from .serializers import WebhookSerializer
-from .tasks import send_data_task
+from .routing import delivery_queue
+from .serializers import DeliveryAttemptSerializer, TaskBatchSerializer, WebhookSerializer
+from .tasks import flush_webhook_batch, send_data_task
+from .throttling import aadmit, athrottle
 
 
-class WebhookCreateView(PermIsAuthenticated, APIView):
+class AsyncAPIView(APIView):
 
-    def post(self, request):
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            # Authentication may hit the session table, so it is the one step that still runs in a thread.
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            handler = getattr(self, request.method.lower(), None)
+            if request.method.lower() not in self.http_method_names or handler is None:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class WebhookCreateView(PermIsAuthenticated, AsyncAPIView):
+
+    async def post(self, request):
         serializer = WebhookSerializer(data=request.data)
-        if serializer.is_valid(raise_exception=True):
-            serializer.save(user=request.user)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        serializer.is_valid(raise_exception=True)
+        webhook = await Webhook.objects.acreate(user=request.user, **serializer.validated_data)
+        return Response(WebhookSerializer(webhook).data, status=status.HTTP_201_CREATED)
 
 
-class WebhookWriteView(PermIsAuthenticated, APIView):
+class WebhookBulkCreateView(PermIsAuthenticated, APIView):
+    parser_classes = [CodecJSONParser, NDJSONParser]
 
-    def post(self, request, webhook_id):
-        try:
-            Webhook.objects.get(id=webhook_id, user=request.user)
-        except Webhook.DoesNotExist:
+    def post(self, request):
+        if isinstance(request.data, list) and len(request.data) > settings.WEBHOOK_BULK_MAX_ITEMS:
+            return Response(
+                {'error': f'Too many items, the limit is {settings.WEBHOOK_BULK_MAX_ITEMS}'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        serializer = WebhookSerializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        webhooks = bulk_create_webhooks(request.user, serializer.validated_data)
+        return Response(WebhookSerializer(webhooks, many=True).data, status=status.HTTP_201_CREATED)
+
+
+class BatchingMixin:
+    queue = None
+
+    async def _batch(self, webhook_id, task_id, payload, window):
+        # Only the write that opens a batch, or fills it, schedules the flush.
+        delay = await aappend(webhook_id, task_id, payload, window)
+        if delay is not None:
+            await enqueue_task(
+                flush_webhook_batch, args=[webhook_id], queue=self.queue or settings.WEBHOOK_BATCH_FLUSH_QUEUE,
+                countdown=delay or None,
+            )
+
+
+def _queue_full():
+    return Response({'error': 'Delivery queue is full'}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={'Retry-After': str(settings.WEBHOOK_ADMISSION_RETRY_AFTER)})
+
+
+class WebhookWriteView(BatchingMixin, PermIsAuthenticated, AsyncAPIView):
+
+    async def post(self, request, webhook_id):
+        owner = await aget_owner(webhook_id)
+        if owner is None or owner.user_id != request.user.id:
             return Response({'error': 'Webhook not found'}, status=status.HTTP_404_NOT_FOUND)
+        # Checked after ownership, so nobody can drain the bucket of a webhook they do not own.
+        wait = await athrottle(request.user.id, webhook_id)
+        if wait:
+            raise Throttled(wait)
+        queue = self.queue or delivery_queue(request.user.id, owner.priority)
+        if not await aadmit(queue):
+            return _queue_full()
+
+        payload = build_payload(request.data)
+        key = write_key(request, payload.digest)
+        if key is not None and len(key) > MAX_KEY_LENGTH:
+            return Response({'error': 'Idempotency-Key is too long'}, status=status.HTTP_400_BAD_REQUEST)
 
-        task = send_data_task.delay(request.data)
-        return Response({'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
+        task_id = str(uuid.uuid4())
+        if key is not None:
+            existing = await aclaim(webhook_id, key, task_id)
+            if existing is not None:
+                return Response({'task_id': existing}, status=status.HTTP_202_ACCEPTED,
+                                headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            await astore_payload(payload)
+            if owner.batch_window:
+                await self._batch(webhook_id, task_id, payload, owner.batch_window)
+            else:
+                await enqueue_task(
+                    send_data_task, kwargs={'webhook_id': webhook_id, 'payload': payload.digest}, queue=queue,
+                    task_id=task_id,
+                )
+        except Exception:
+            if key is not None:
+                await arelease(webhook_id, key)
+            raise
+        return Response({'task_id': task_id}, status=status.HTTP_202_ACCEPTED)
+
+
+class TopicPublishView(BatchingMixin, PermIsAuthenticated, AsyncAPIView):
+
+    async def post(self, request, topic_id):
+        if not await Topic.objects.filter(id=topic_id, user=request.user).aexists():
+            return Response({'error': 'Topic not found'}, status=status.HTTP_404_NOT_FOUND)
+        payload = build_payload(request.data)
+        key = write_key(request, payload.digest)
+        if key is not None and len(key) > MAX_KEY_LENGTH:
+            return Response({'error': 'Idempotency-Key is too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = Subscription.objects.filter(topic_id=topic_id).values_list(
+            'webhook_id', 'webhook__user_id', 'webhook__priority', 'webhook__batch_window'
+        )
+        subscribers = [row async for row in rows]
+        # The publisher pays one token per delivery, and every queue the fan-out lands on must have room.
+        wait = await athrottle(request.user.id, cost=max(len(subscribers), 1))
+        if wait:
+            raise Throttled(wait)
+        queues = {self.queue or delivery_queue(user_id, priority) for _, user_id, priority, window in subscribers
+                  if not window}
+        for queue in sorted(queues):
+            if not await aadmit(queue):
+                return _queue_full()
+
+        task_ids = {webhook_id: str(uuid.uuid4()) for webhook_id, *_ in subscribers}
+        # Publishes are claimed per topic, a replay returns the task ids of the first publish.
+        claim = f'topic-{topic_id}'
+        if key is not None:
+            claimed = codec.dumps_str({str(webhook_id): task_id for webhook_id, task_id in task_ids.items()})
+            existing = await aclaim(claim, key, claimed)
+            if existing is not None:
+                replayed = {int(webhook_id): task_id for webhook_id, task_id in codec.loads(existing).items()}
+                return Response({'task_ids': replayed}, status=status.HTTP_202_ACCEPTED,
+                                headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            # The body is stored once, every subscriber's delivery references it by digest.
+            await astore_payload(payload)
+            calls = []
+            for webhook_id, user_id, priority, window in subscribers:
+                if window:
+                    await self._batch(webhook_id, task_ids[webhook_id], payload, window.total_seconds())
+                else:
+                    calls.append((
+                        {'webhook_id': webhook_id, 'payload': payload.digest},
+                        self.queue or delivery_queue(user_id, priority), task_ids[webhook_id],
+                    ))
+            await enqueue_tasks(send_data_task, calls)
+        except Exception:
+            if key is not None:
+                await arelease(claim, key)
+            raise
+        return Response({'task_ids': task_ids}, status=status.HTTP_202_ACCEPTED)
 
 
 class WebhookViewSet(PermIsAuthenticated, ListAPIView):
-    queryset = Webhook.objects.all()
     serializer_class = WebhookSerializer
+    pagination_class = WebhookCursorPagination
+
+    def get_queryset(self):
+        queryset = Webhook.objects.filter(user=self.request.user)
+        return filter_data(filter_created_range(queryset, self.request.query_params), self.request.query_params)
+
+
+class WebhookExportView(PermIsAuthenticated, AsyncAPIView):
+
+    async def get(self, request, export_format):
+        if export_format not in CONTENT_TYPES:
+            return Response({'error': f'Unknown format {export_format}'}, status=status.HTTP_404_NOT_FOUND)
+
+        queryset = filter_created_range(Webhook.objects.filter(user=request.user), request.query_params)
+        queryset = filter_data(queryset, request.query_params)
+        response = StreamingHttpResponse(
+            aiter_export(queryset, export_format), content_type=CONTENT_TYPES[export_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="webhooks.{export_format}"'
+        return response
+
+
+class WebhookArchiveView(PermIsAuthenticated, AsyncAPIView):
+
+    async def get(self, request):
+        if not archive_enabled():
+            return Response({'error': 'Archive is not enabled'}, status=status.HTTP_404_NOT_FOUND)
+        since = parse_datetime_param(request.query_params, 'since')
+        until = parse_datetime_param(request.query_params, 'until')
+        return StreamingHttpResponse(
+            aread_archive([request.user.id], since, until), content_type=CONTENT_TYPES['ndjson']
+        )
 
 
 class WebhookDetailView(PermIsAuthenticated, RetrieveDestroyAPIView):
@@ -49,39 +245,56 @@ class WebhookDetailView(PermIsAuthenticated, RetrieveDestroyAPIView):
     serializer_class = WebhookSerializer
 
 
-class TaskResultView(PermIsAuthenticated, APIView):
+def _latest_attempts(user, task_ids):
+    return DeliveryAttempt.objects.filter(task_id__in=task_ids, webhook__user=user).order_by(
+        'task_id', '-created_at', '-id'
+    ).distinct('task_id')
 
-    def get(self, request, task_id):
-        result = send_data_task.AsyncResult(task_id)
-        if result.ready():
-            return Response({'result': result.get()}, status=status.HTTP_200_OK)
-        return Response({'status': 'pending'}, status=status.HTTP_202_ACCEPTED)
 
+def _attempt_response(attempt):
+    if attempt is None or attempt.status not in DeliveryAttempt.FINAL_STATUSES:
+        return {'status': 'pending'}
+    return {'result': DeliveryAttemptSerializer(attempt).data}
 
-class KeycloakLoginView(View):
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.keycloak_openid = KeycloakOpenID(
-            server_url=settings.KEYCLOAK_SERVER_URL,
-            client_id=settings.KEYCLOAK_CLIENT_ID,
-            realm_name=settings.KEYCLOAK_REALM,
-            client_secret_key=settings.KEYCLOAK_CLIENT_SECRET
-        )
+class TaskResultView(PermIsAuthenticated, AsyncAPIView):
+
+    async def get(self, request, task_id):
+        attempt = await _latest_attempts(request.user, [task_id]).afirst()
+        body = _attempt_response(attempt)
+        if 'result' in body:
+            return Response(body, status=status.HTTP_200_OK)
+        return Response(body, status=status.HTTP_202_ACCEPTED)
+
+
+class TaskBatchResultView(PermIsAuthenticated, APIView):
+
+    def post(self, request):
+        serializer = TaskBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        task_ids = serializer.validated_data['task_ids']
+
+        attempts = {attempt.task_id: attempt for attempt in _latest_attempts(request.user, task_ids)}
+        results = {task_id: _attempt_response(attempts.get(task_id)) for task_id in task_ids}
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+class KeycloakLoginView(View):
 
     def get(self, request, *args, **kwargs):
+        keycloak_openid = get_keycloak_openid()
         redirect_uri = request.build_absolute_uri(reverse('keycloak_login'))
         code = request.GET.get('code')
 
         if code:
             try:
-                token_response = self.keycloak_openid.token(
+                token_response = keycloak_openid.token(
                     grant_type='authorization_code',
                     code=code,
                     redirect_uri=redirect_uri
                 )
 
-                user = self._get_or_create_user(self.keycloak_openid.userinfo(token_response['access_token']))
+                user = sync_user(keycloak_openid.userinfo(token_response['access_token']))
 
                 login(request, user)
 
@@ -89,36 +302,11 @@ class KeycloakLoginView(View):
             except Exception as e:
                 return HttpResponse("Authentication failed", status=401)
 
-        keycloak_login_url = self.keycloak_openid.auth_url(redirect_uri=redirect_uri, scope="openid profile roles")
+        keycloak_login_url = keycloak_openid.auth_url(redirect_uri=redirect_uri, scope="openid profile roles")
         return redirect(keycloak_login_url)
 
-    def _get_or_create_user(self, user_info: dict) -> dict:
-        changes_user = False
-        userinfo = UserInfo(**user_info)
-
-        username = userinfo.preferred_username
-        email = userinfo.email
-        first_name = userinfo.given_name
-        last_name = userinfo.family_name
-        user, created = User.objects.get_or_create(username=username)
-
-        if created or user.email != email or user.first_name != first_name or user.last_name != last_name:
-            user.email = email
-            user.first_name = first_name
-            user.last_name = last_name
-            changes_user = True
 
-        keycloak_roles = userinfo.group or []
-        if ('/superuser' in keycloak_roles != user.is_superuser) or (
-                '/staff' in keycloak_roles != user.is_staff
-        ) or (user.is_superuser != user.is_staff):
-            user.is_superuser = '/superuser' in keycloak_roles
-            user.is_staff = '/staff' in keycloak_roles or user.is_superuser
-            changes_user = True
+class MetricsView(View):
 
-        if changes_user:
-            user.save()
-
-        user.refresh_from_db()
-
-        return user
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(generate_latest(metrics_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -1,8 +1,12 @@
 import os
 from celery import Celery
 
+from myapp.codec import register_kombu_serializer
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'testkeycloak.settings')
 
+register_kombu_serializer()
+
 app = Celery('keycloak')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic.v1 import BaseSettings
 
 
@@ -15,6 +17,9 @@ class Settings(BaseSettings):
     KEYCLOAK_PASSWORD: str
     DB_VENDOR: str
     DB_ADDR: str
+    CELERY_WORKER_METRICS_PORT: Optional[int] = None
+    WEBHOOK_ARCHIVE_DIR: Optional[str] = None
+    KEYCLOAK_ISSUER: Optional[str] = None
 
     class Config:
         env_file = ".env"
@@ -9,9 +9,11 @@ https://docs.djangoproject.com/en/5.0/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
+from datetime import timedelta
 from pathlib import Path
 
 from celery.schedules import crontab
+from kombu import Queue
 
 from testkeycloak.secrets import settings
 
@@ -46,13 +48,24 @@ INSTALLED_APPS = [
 ]
 
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': (
+        'myapp.renderers.CodecJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'myapp.parsers.CodecJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.TokenAuthentication',
+        'myapp.authentication.KeycloakJWTAuthentication',
     ),
 }
 
 MIDDLEWARE = [
+    "myapp.metrics.metrics_middleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -109,15 +122,156 @@ KEYCLOAK_REALM = 'master'
 KEYCLOAK_CLIENT_ID = 'django-client'
 KEYCLOAK_CLIENT_SECRET = settings.KEYCLOAK_CLIENT_SECRET
 KEYCLOAK_PROTOCOL = 'openid-connect'
+KEYCLOAK_JWT_ALGORITHMS = ['RS256']
+# Bearer tokens must be access tokens issued by this realm for this client, through azp or aud.
+# Set KEYCLOAK_ISSUER when clients reach Keycloak under another URL than the internal one
+KEYCLOAK_AUDIENCE = KEYCLOAK_CLIENT_ID
+KEYCLOAK_ISSUER = settings.KEYCLOAK_ISSUER or f"{KEYCLOAK_SERVER_URL.rstrip('/')}/realms/{KEYCLOAK_REALM}"
+KEYCLOAK_TOKEN_TYPE = 'Bearer'
+KEYCLOAK_JWKS_TTL = 300
+KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL = 10
+KEYCLOAK_CLAIMS_CACHE_SIZE = 10000
+KEYCLOAK_USER_CACHE_TTL = 300
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://redis:6379/1',
+    }
+}
+
+REDIS_URL = 'redis://redis:6379/0'
 
-CELERY_BROKER_URL = 'redis://redis:6379/0'
-CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
+# Registered in testkeycloak/celery.py, plain json stays accepted for messages from other producers
+CELERY_TASK_SERIALIZER = 'webhook-json'
+CELERY_RESULT_SERIALIZER = 'webhook-json'
+CELERY_ACCEPT_CONTENT = ['webhook-json', 'json']
 CELERY_BEAT_SCHEDULE = {
     'delete_old_webhooks_every_hour': {
         'task': 'myapp.tasks.delete_old_webhooks',
         'schedule': crontab(minute='*/1'),
     },
+    'create_webhook_partitions_every_hour': {
+        'task': 'myapp.tasks.create_webhook_partitions',
+        'schedule': crontab(minute=0),
+    },
+    'dispatch_due_retries_every_second': {
+        'task': 'myapp.tasks.dispatch_due_retries',
+        'schedule': timedelta(seconds=1),
+        'options': {'expires': 5},
+    },
+}
+
+WEBHOOK_BULK_MAX_ITEMS = 10000
+WEBHOOK_BULK_BATCH_SIZE = 1000
+WEBHOOK_COPY_THRESHOLD = 2000
+
+WEBHOOK_RETENTION = timedelta(hours=4)
+# Longest retention a client may set on its own webhook, longer ones go through a RetentionPolicy
+WEBHOOK_MAX_RETENTION = timedelta(days=7)
+WEBHOOK_RETENTION_CHUNK_SIZE = 5000
+WEBHOOK_RETENTION_TIME_BUDGET = 30
+
+# When set, retention writes expiring webhooks to gzip NDJSON segments under this directory, one directory
+# per day of creation, before deleting them. Each segment has an index with one record per block of rows
+WEBHOOK_ARCHIVE_DIR = settings.WEBHOOK_ARCHIVE_DIR
+WEBHOOK_ARCHIVE_BLOCK_ROWS = 1000
+
+# Range-partition myapp_webhook by hour on PostgreSQL, applied by migration 0004 or `create_webhook_partitions --convert`
+WEBHOOK_PARTITIONING = False
+WEBHOOK_PARTITIONS_AHEAD = 24
+
+WEBHOOK_DELIVERY_CONNECT_TIMEOUT = 3.0
+WEBHOOK_DELIVERY_READ_TIMEOUT = 10.0
+WEBHOOK_DELIVERY_NUM_POOLS = 100
+WEBHOOK_DELIVERY_POOL_MAXSIZE = 10
+WEBHOOK_DELIVERY_QUEUE = 'deliveries'
+# Deliveries are spread by user over WEBHOOK_DELIVERY_SHARDS queues named deliveries.<n>, 0 keeps the single
+# queue. Priority webhooks use their own lane, which the asyncio worker serves WEBHOOK_PRIORITY_QUANTUM
+# messages at a time for every message of a shard. The unsharded queue is still consumed so older
+# messages drain, and it is where deliveries published without a queue land.
+WEBHOOK_DELIVERY_SHARDS = 8
+WEBHOOK_PRIORITY_QUEUE = 'deliveries.priority'
+WEBHOOK_PRIORITY_QUANTUM = 4
+CELERY_TASK_ROUTES = {
+    'myapp.tasks.send_data_task': {'queue': WEBHOOK_DELIVERY_QUEUE},
+}
+# Workers started without -Q consume all of these, kombu rotates between non-empty queues per message
+CELERY_TASK_QUEUES = [
+    Queue(name) for name in [
+        'celery', WEBHOOK_PRIORITY_QUEUE, WEBHOOK_DELIVERY_QUEUE,
+        *(f'{WEBHOOK_DELIVERY_QUEUE}.{shard}' for shard in range(WEBHOOK_DELIVERY_SHARDS)),
+    ]
+]
+# In-flight deliveries per `run_async_worker` process
+WEBHOOK_ASYNC_MAX_IN_FLIGHT = 200
+
+# Used for webhooks without their own RetryPolicy, delays are in seconds
+WEBHOOK_RETRY_POLICY = {
+    'max_retries': 5,
+    'base_delay': 5,
+    'max_delay': 300,
+    'max_age': timedelta(hours=1),
 }
+WEBHOOK_RETRY_DISPATCH_BATCH = 1000
+
+WEBHOOK_TASK_BATCH_MAX = 1000
+
+# Webhook owners looked up by the write endpoint, the in-process tier is short lived because
+# other processes only see invalidations through Redis
+WEBHOOK_OWNER_CACHE_TTL = 3600
+WEBHOOK_OWNER_LOCAL_CACHE_SIZE = 100000
+WEBHOOK_OWNER_LOCAL_CACHE_TTL = 5
+# A forgotten owner leaves a tombstone this many seconds, so a lookup that read the row before the change
+# cannot cache it again
+WEBHOOK_OWNER_TOMBSTONE_TTL = 10
+
+# Broker queues reported as webhook_queue_depth on /metrics, Celery workers serve their own
+# metrics on this port when set
+WEBHOOK_METRICS_QUEUES = [queue.name for queue in CELERY_TASK_QUEUES]
+CELERY_WORKER_METRICS_PORT = settings.CELERY_WORKER_METRICS_PORT
+
+# Token buckets for the write endpoint, per user and per webhook: sustained writes per second and burst
+# size, a rate of None turns the bucket off. Writes are refused with 503 while the delivery queue holds
+# more than WEBHOOK_ADMISSION_QUEUE_DEPTH messages, sampled every WEBHOOK_ADMISSION_CHECK_INTERVAL seconds.
+WEBHOOK_USER_WRITE_RATE = 100
+WEBHOOK_USER_WRITE_BURST = 500
+WEBHOOK_WRITE_RATE = 20
+WEBHOOK_WRITE_BURST = 100
+WEBHOOK_THROTTLE_LOCAL_SIZE = 100000
+WEBHOOK_ADMISSION_QUEUE_DEPTH = 100000
+WEBHOOK_ADMISSION_CHECK_INTERVAL = 1
+WEBHOOK_ADMISSION_RETRY_AFTER = 5
+
+# Deliveries to a host are parked instead of attempted once at least WEBHOOK_BREAKER_MIN_REQUESTS of its
+# deliveries within WEBHOOK_BREAKER_WINDOW seconds failed at WEBHOOK_BREAKER_FAILURE_RATE or more (0 turns
+# breakers off). After WEBHOOK_BREAKER_OPEN_SECONDS one probe at a time goes through, WEBHOOK_BREAKER_PROBES
+# successes in a row close the breaker. Workers remember an open breaker locally for up to the local TTL
+WEBHOOK_BREAKER_FAILURE_RATE = 0.5
+WEBHOOK_BREAKER_MIN_REQUESTS = 20
+WEBHOOK_BREAKER_WINDOW = 60
+WEBHOOK_BREAKER_OPEN_SECONDS = 30
+WEBHOOK_BREAKER_PROBES = 3
+WEBHOOK_BREAKER_PROBE_TIMEOUT = 30
+WEBHOOK_BREAKER_LOCAL_TTL = 1
+
+# Webhooks with a batch_window coalesce their writes into one delivery of a JSON array, sent when the
+# window closes or once the batch holds this many events or bytes, whichever comes first
+WEBHOOK_BATCH_MAX_EVENTS = 100
+WEBHOOK_BATCH_MAX_BYTES = 1024 * 1024
+WEBHOOK_BATCH_FLUSH_QUEUE = 'celery'
+# Longest batch_window a client may set, the flush is a countdown task and must not turn into a long ETA
+WEBHOOK_MAX_BATCH_WINDOW = timedelta(minutes=5)
+
+# Writes with a repeated Idempotency-Key, or without one the same canonical JSON body, to the same
+# webhook within the TTL return the original task id instead of enqueuing again
+WEBHOOK_IDEMPOTENCY_TTL = 600
+WEBHOOK_DEDUPLICATE_PAYLOADS = True
+
+# Rows fetched per server-side cursor round trip and encoded per streamed chunk by exports
+WEBHOOK_EXPORT_CHUNK_SIZE = 2000
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -17,10 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
-from myapp.views import KeycloakLoginView
+from myapp.views import KeycloakLoginView, MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('keycloak/login/', KeycloakLoginView.as_view(), name='keycloak_login'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('', include("myapp.urls")),
 ]